@@ -0,0 +1,90 @@
+# Benchmark of the placement of model priors on the grid of observables.
+# Computes the probability densities at the data points at one age with nearest and linear (cloud-in-cell)
+# deposition, on the computed model grids and on coarser ones, and reports their relative differences
+# from the densities with nearest deposition on the computed model grids, which is the baseline.
+# Coarser model grids are emulated by taking every n-th initial mass and initial omega of the computed ones;
+# their maximum observable differences between neighboring models are reported
+# in minimum standard deviations, i.e. in the units of config.dmax.
+# The differences from the same deposition on the computed model grids are also reported,
+# since the baseline itself places each model at the grid point below it, i.e. half a grid step off on average.
+# Usage: python bench_deposit.py [index of the age in the observables directory] [strides, e.g. 1,2,3]
+import sys, time
+from lib import dens_util as du
+from lib import obs_util as ou
+from lib import diag_util as dg
+import calc_dens
+import load_data
+import config
+import numpy as np
+
+# indices of every n-th element of an array of a given length, including the last element
+def every(length, n):
+	return np.unique(np.append(np.arange(0, length, n), length - 1))
+
+# Probability densities at the data points for the rotational and multiplicity populations at an age
+# Inputs:
+#	observables at the age, as saved
+#	stride in the initial mass and initial omega dimensions
+#	deposition: 'nearest' or 'linear'
+#	data catalog
+#	residual kernels and slices of the data points; computed if None
+#	configuration
+# Output: densities at the data points; dimensions: multiplicity population, rotational population, data point;
+#	the number of models, the maximum observable differences in the mass and omega dimensions,
+#	the residual kernels and slices
+def densities(obs, stride, deposit, ld, kernels=None, slices=None, cf=config):
+	iM = every(len(obs.Mini), stride)
+	io = every(len(obs.omega0), stride)
+	Mini, omega0 = obs.Mini[iM], obs.omega0[io]
+	blocks = [ (rs, ob[iM]) for rs, ob in obs.blocks(omega0=io) ]
+	maxdiff = [ np.nanmax(np.concatenate([ dg.nanmax_diff(ob, axis, cf=cf) for rs, ob in blocks ])) \
+		for axis in [0, 2] ]
+	nmod = sum(ob[..., 0].size for rs, ob in blocks)
+	# depositions on the grid of observables and on the CMD grid
+	prior = calc_dens.model_prior(Mini, obs.r, omega0, obs.inc)
+	pr_om = calc_dens.omega_prior(omega0, cf.om_sets[:1])
+	dep = du.deposits(blocks, [ld.obs_grids, ld.obs_grids[:2]], prior, pr_om, linear=deposit == 'linear')
+	del blocks
+	pr_ch = []
+	for d in dep:
+		p = d.channels()
+		pr_ch.append( [ p[0] if mult == 'unary' else p[1] for mult in cf.mult ] )
+	sigma = calc_dens.residual_sigma(ld, cf=cf)
+	points = np.full( (len(cf.mult), len(cf.om_mean), ld.obs.shape[0]), np.nan )
+	for k in range(len(cf.mult)):
+		for j in range(len(cf.om_mean)):
+			dens = calc_dens.population_densities(dep[0].grid(pr_ch[0][k][j]), dep[1].grid(pr_ch[1][k][j]), \
+				obs.age, ld, cf=cf)
+			if kernels is None: kernels, slices = du.calc_kernels(dens[0], sigma, cf.nsig - 1, ld=ld)
+			points[k, j] = calc_dens.point_densities(*dens, kernels, slices, sigma, ld)
+	return points, nmod, maxdiff, kernels, slices
+
+def main(it=0, strides=[1, 2, 3], cf=config):
+	ld = load_data.Catalog(cf).load()
+	obs = ou.Obs(ou.obs_dirs(cf.obs_dir)[it])
+	print('t = ' + '%.4f' % obs.age)
+	start = time.time()
+	base, nmod, md, kernels, slices = densities(obs, 1, 'nearest', ld, cf=cf)
+	print('baseline: nearest deposition on the computed model grid, ' + str(nmod) + ' models, ' + \
+		'%.1f' % (time.time() - start) + ' seconds')
+	m = np.isfinite(base) & (base > 0)
+	# relative differences from the baseline and from the same deposition on the computed model grid
+	print('%-8s %6s %10s %6s %6s | %9s %9s %9s | %9s %9s %9s' % ('deposit', 'stride', 'models', 'dM', 'domega', \
+		'median', '95%', 'max', 'median', '95%', 'max'))
+	full = {'nearest': base} 
+	for stride in strides:
+		for deposit in ['nearest', 'linear']:
+			if stride == 1 and deposit == 'nearest': points = base
+			else: points, nmod, md = densities(obs, stride, deposit, ld, kernels, slices, cf=cf)[:3]
+			if stride == 1: full[deposit] = points
+			line = '%-8s %6d %10d %6.2f %6.2f' % (deposit, stride, nmod, md[0], md[1])
+			for ref in [base, full.get(deposit)]:
+				if ref is None: line += ' | %29s' % '-'; continue
+				err = np.abs(points[m] / ref[m] - 1)
+				line += ' | %9.2e %9.2e %9.2e' % (np.median(err), np.percentile(err, 95), err.max())
+			print(line, flush=True)
+
+if __name__ == '__main__':
+	it = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+	strides = [int(n) for n in sys.argv[2].split(',')] if len(sys.argv) > 2 else [1, 2, 3]
+	main(it, strides)
@@ -1,11 +1,13 @@
-# CAUTION: only run this if you have ~100 GB of space on the hard drive for the output
-# Conduct all the operations on models grids that produce 
+# CAUTION: only run this if you have ~50 GB of space on the hard drive for the float32 output (less if compressed)
+# Conduct all the operations on models grids that produce
 # 	observables on (t, M, r, omega, i).
-# This includes 
+# This includes
 #	refinement of (M, omega, i) grids at r = 0 and different t,
 # 	computation of the observables on (M, r, omega, i) grids at different t,
 # 	checking that observable differences between neighboring models are small enough in the r dimension,
 #	checking that the differences between neighboring isochrones are small enough.
+# Ages whose observables are complete, according to the manifest in the observables directory, are skipped,
+# so that an interrupted run resumes at the remaining ages.
 
 # PARS imports
 import sys, os, time, pickle
@@ -16,104 +18,151 @@ from pa.opt import grid as gd
 # cluster parameters imports
 from lib import mist_util as mu
 from lib import dens_util as du
-import load_data as ld
-import config as cf
+from lib import obs_util as ou
+from lib import diag_util as dg
+import load_data
+import config
 # Python imports
 import numpy as np
-import gc 
+import gc
+import multiprocessing
 
 # pre-compute Roche model volume versus PARS's omega
 # and PARS's omega versus MESA's omega
 sf.calcVA()
 sf.calcom()
 
-# Load and filter MIST models
-print('Loading MIST...', end='')
-start = time.time()
-st = mu.Set('data/mist_grid.npy')
-
-st.select_MS() # select main sequence
-st.select_Z(cf.Z) # select metallicity
-st.select_valid_rotation() # select rotation with omega < 1
-st.set_omega0() # set omega from omega_M; ignore the L_edd factor
-
-# choose isochrone ages so that the space of age prior parameters with appreciable likelihoods
-# is covered sufficiently finely
-nt = 17
-it = 100
-
-# use the following if the program stalls
-# ages = 1 # 1 or 2
-# if ages == 1:
-# 	nt = 9 # number of ages to take from the MIST grid
-# 	it = 100 # first index of the MIST ages to take
-# elif ages == 2: 
-# 	nt = 9 # number of ages to take from the MIST grid
-# 	it = 108 # first index of the MIST ages to take
-
-lt = 5; splits = [lt] * (nt - 1)  # number of ages for each interval to give linspace
-t = np.unique(st.t)[it : it + nt] # ages around 9.159
-st.select(np.isin(st.t, t)) # select the ages
-
-# check that initial masses aren't multi-valued at constant (EEP, omega0, age)
-EEP = np.unique(st.EEP)
-oM0 = np.unique(st.oM0)
-for tv in t:
-	for eep in EEP:
-		for o0 in oM0:
-			x = st.Mini[(st.EEP == eep) & (st.oM0 == o0) & (st.t == tv)]
-			if len(x) > 1: print('multivalued initial masses:', tv, eep, o0, x)
-
-print('%.2f' % (time.time() - start) + ' seconds.')
-
-# split time intervals: each array begins and ends with a MIST grid age, intermediate ages in between
-ts = [np.linspace(t[i], t[i+1], splits[i]) for i in range(nt - 1)]
-t_orig = [True]
-for i in range(nt - 1): t_orig = [True] + [False]*(lt - 2) + t_orig
-t = np.unique(np.concatenate(ts)) # refined ages
-# non-rotating models at these ages and full mass range
-stc = st.copy(); stc.select(stc.omega0 == 0)  
-
-print('Loading PARS...', end='', flush=True)
-start = time.time()
-with open('data/pars_grid_ZM' + str(cf.Z).replace('-', 'm').replace('.', 'p') + '.pkl', 'rb') as f: 
-	pars = pickle.load(f)
-print('%.2f' % (time.time() - start) + ' seconds.' + '\n', flush=True)
-mu.Grid.pars = pars # give a PARS grid reference to the grid class
-# apply the lower mass cut-off for the primaries according the region of interest on the CMD 
-st1 = st.copy(); st1.select_age( t[-1] ) # pick the highest age
-Mmin = mu.Mlim(st1)
-st.select_mass(Mmin=Mmin)
-print('minimum mass = ' + '%.4f' % Mmin, flush=True)
-
-nsig = cf.nsig - 1 # number of standard deviations to extend Gaussian kernels
-npts = ld.obs.shape[0] # number of data points
-ndim = ld.obs.shape[1] # number of observable dimensions
-
-it_0 = 0 # first age index
-for it in range(it_0, len(t)):
-	### refinement of (M, omega, i) grids at r = 0 and different t
-	print('\nt = ' + '%.4f' % t[it], end=':')
-	if t_orig[it]: print(' original model grid age.')
-	else: print(' new intermediate age.')
-	t_str = '_t' + ('%.4f' % t[it]).replace('.', 'p')
+# Load and filter MIST models at a given metallicity
+def load_mist(Z):
+	print('Loading MIST...', end='')
+	start = time.time()
+	st = mu.Set('data/mist_grid.npy')
+
+	st.select_Z(Z) # select metallicity
+	st.select_MS() # select main sequence
+	st.select_valid_rotation() # select rotation with omega < 1
+	st.set_omega0() # set omega from omega_M; ignore the L_edd factor
+	print('%.2f' % (time.time() - start) + ' seconds.')
+	return st
+
+# Load the PARS grid for a configuration
+def load_pars(cf):
+	print('Loading PARS...', end='', flush=True)
+	start = time.time()
+	with open(cf.pars_file(), 'rb') as f:
+		pars = pickle.load(f)
+	print('%.2f' % (time.time() - start) + ' seconds.' + '\n', flush=True)
+	return pars
+
+# Compute the observables for a configuration
+# Inputs:
+#	configuration, e.g. the config module
+#	MIST models at the configuration's metallicity, as returned by load_mist(); these are not modified
+#	PARS grid at the configuration's metallicity, as returned by load_pars()
+def main(cf=config, st=None, pars=None):
+	ld = load_data.Catalog(cf).load()
+	if st is None: st = load_mist(cf.Z)
+	else: st = st.copy()
+	start = time.time()
+
+	# choose isochrone ages so that the space of age prior parameters with appreciable likelihoods
+	# is covered sufficiently finely
+	nt = 17
+	it = 100
+
+	lt = 5; splits = [lt] * (nt - 1)  # number of ages for each interval to give linspace
+	t = np.unique(st.t)[it : it + nt] # ages around 9.159
+	st.select_range('t', t[0], t[-1]) # select the ages
+
+	# check that initial masses aren't multi-valued at constant (EEP, omega0, age)
+	for age, EEP, oM0, x in dg.multivalued(st):
+		print('multivalued initial masses:', age, EEP, oM0, x)
+
+	print('%.2f' % (time.time() - start) + ' seconds.')
+
+	# split time intervals: each array begins and ends with a MIST grid age, intermediate ages in between
+	ts = [np.linspace(t[i], t[i+1], splits[i]) for i in range(nt - 1)]
+	t_orig = [True]
+	for i in range(nt - 1): t_orig = [True] + [False]*(lt - 2) + t_orig
+	t = np.unique(np.concatenate(ts)) # refined ages
+	# non-rotating models at these ages and full mass range
+	stc = st.copy(); stc.select(stc.omega0 == 0)
+
+	if pars is None: pars = load_pars(cf)
+	mu.Grid.pars = pars # give a PARS grid reference to the grid class
+	# apply the lower and upper mass cut-offs for the primaries according the region of interest on the CMD
+	st1 = st.copy(); st1.select_age( t[-1] ) # pick the highest age
+	Mmin, _ = mu.Mlim(st1, cf=cf, ld=ld)
+	st1 = st.copy(); st1.select_age( t[0] ) # pick the lowest age
+	_, Mmax = mu.Mlim(st1, cf=cf, ld=ld)
+	st.select_mass(Mmin=Mmin, Mmax=Mmax)
+	print('minimum mass = ' + '%.4f' % Mmin + ', maximum mass = ' + '%.4f' % Mmax, flush=True)
+
+	# record of the ages with complete observables; these are skipped, e.g. when resuming an interrupted run
+	manifest = ou.Manifest(cf)
+	if cf.nproc > 1:
+		calc_ages_parallel(cf, ld, st, stc, t, t_orig, manifest)
+		return
+
+	for it in range(len(t)):
+		### refinement of (M, omega, i) grids at r = 0 and different t
+		print('\nt = ' + '%.4f' % t[it], end=':')
+		if t_orig[it]: print(' original model grid age.')
+		else: print(' new intermediate age.')
+		if manifest.complete(t[it]):
+			print('observables already computed.')
+			# the metadata of the observables has the omega and inclination grids
+			grid = ou.Obs(ou.obs_dir(cf, t[it]))
+			summary = dg.load(ou.obs_dir(cf, t[it]))
+		elif t_orig[it]:
+			grid, summary = calc_age(cf, ld, st, stc, t[it])
+			manifest.record(t[it], summary, grid.stalled)
+		else:
+			# refine with the omega and inclination grids fixed
+			grid, summary = calc_age(cf, ld, st, stc, t[it], o0=omega0_grid, inc=inc_grid)
+			manifest.record(t[it], summary, grid.stalled)
+		if t_orig[it]:
+			# save the omega and inclination grids for the use in the next age
+			omega0_grid = grid.omega0
+			inc_grid = grid.inc
+
+		# compute the distance from the previous-age isochrone if it exists
+		if it > 0:
+			d = dg.isochrone_distance(summary_prev, summary, cf=cf)
+			print('magnitude, color, vsini minimum-error distances from the previous isochrone: ' +\
+				', '.join('%.4f' % x for x in d))
+		summary_prev = summary
+
+		# mark large variables for cleanup
+		del grid
+		gc.collect() # collect garbage / free up memory
+		# # look at the sizes of the largest variables
+		# for name, size in sorted(((name, sys.getsizeof(value)) for name, value in locals().items()),
+		# 						 key= lambda x: -x[1])[:10]:
+		# 	print("{:>30}: {:>8}".format(name, mu.sizeof_fmt(size)))
+
+# Compute and save the observables at one age
+# Inputs:
+#	configuration
+#	catalog that determines the observable space region
+#	primary and non-rotating model sets at a range of ages that includes this age
+#	age
+#	omega and inclination grids; if not given, these are refined along with the mass grid
+# Outputs:
+#	model grid on which the observables are computed
+#	summary of the observables, as saved next to them
+def calc_age(cf, ld, st, stc, age, o0=None, inc=None):
+	t_str = '_t' + ('%.4f' % age).replace('.', 'p')
 	# select age
-	st1 = st.copy(); st1.select_age( t[it] ) # primary model set
-	stc1 = stc.copy(); stc1.select_age( t[it] )	# non-rotating model set for the companions
+	st1 = st.copy(); st1.select_age( age ) # primary model set
+	stc1 = stc.copy(); stc1.select_age( age )	# non-rotating model set for the companions
 	# refine model grids
 	start = time.time(); print('refining the mass, omega and inclination grids...', flush=True)
-	if t_orig[it]:
-		grid = mu.refine_coarsen(st1)
-		# save the omega and inclination grids for the use in the next age
-		omega0_grid = grid.omega0
-		inc_grid = grid.inc
-	else:
-		# refine with the omega and inclination grids fixed
-		grid = mu.refine_coarsen(st1, o0=omega0_grid, inc=inc_grid)
+	grid = mu.refine_coarsen(st1, o0=o0, inc=inc, cf=cf, ld=ld)
 	print('%.2f' % (time.time() - start) + ' seconds.', flush=True)
 
 	# plot maximum differences versus model parameter
-	if plot_model_grids:
+	if cf.plot_model_grids:
 		grid.plot_diff(0, 'data/model_grids/png/diff_vs_Mini' + t_str + cf.z_str + '.png')
 		grid.plot_diff(1, 'data/model_grids/png/diff_vs_omega0' + t_str + cf.z_str + '.png')
 		grid.plot_diff(2, 'data/model_grids/png/diff_vs_inc' + t_str + cf.z_str + '.png')
@@ -123,34 +172,21 @@ for it in range(it_0, len(t)):
 	start = time.time(); print('combining observables...', flush=True)
 
 	# get non-rotating companion magnitudes on a M * r grid; use the full 0 <= r <= 1 grid here
-	mag = mu.companion_grid(cf.r, grid.Mini, stc1, pars, cf.A_V, cf.modulus)
-	# combine the magnitudes of the non-rotating companion and its primary;
+	mag = mu.companion_grid(cf.r, grid.Mini, stc1, mu.Grid.pars, cf.A_V, cf.modulus, cf=cf)
+	# combine the magnitudes of the non-rotating companion and its primary 
+	# and compute the observables of binary models;
 	# companion dimensions: initial primary mass, binary mass ratio, filter
 	# primary dimensions: initial primary mass, initial omega, inclination, filter
-	# final dimensions: initial primary mass, binary mass ratio, initial omega, inclination, filter
-	mag_binary = \
-		mu.combine_mags(mag[..., np.newaxis, np.newaxis, :], grid.mag[:, np.newaxis, ...])
-	# insert the unary magnitudes, which evaluated to NAN above
-	mag_binary[:, 0, ...] = grid.mag
-	# compute the observables of binary models;
-	# dimensions: initial primary mass, binary mass ratio, initial omega, inclination, mag / color / vsini;
-	# the last dimension remains the same if three filters are now magnitude, color and vsini
-	# print('Combining primary and companion magnitudes: ' + str(time.time() - start) + ' seconds.') 
-	obs_binary = np.full( mag_binary.shape, np.nan )
-	obs_binary[..., 0] = mag_binary[..., 1] # F555W magnitude
-	obs_binary[..., 1] = mag_binary[..., 0] - mag_binary[..., 2] # F435W - F814W color
-	obs_binary[..., 2] = grid.vsini[:, np.newaxis, ...] # vsini
-
-	# differences in observables along the r dimension
-	diff = np.abs(np.diff(obs_binary, axis=1))
-	diff = np.moveaxis(diff, 1, -2) # move the r axis from original location to just before observables
-	# mask along the r dimension where the differences are not all NaN
-	m = ~np.all(np.isnan(diff), axis=(0, 1, 2)) # sum over mass, omega and i 
-	# maximum observable differences along the r dimension
-	dm = np.full(m.shape, np.nan)
-	dm[m] = np.nanmax(diff[..., m], axis=(0, 1, 2))
+	# final dimensions: initial primary mass, binary mass ratio, initial omega, inclination, mag / color / vsini;
+	# the unary models are at r = 0;
+	# also get the maximum observable differences along the r dimension;
+	# the observables of binary models are not kept if only the unary models are saved
+	obs_binary, dm = mu.binary_obs(mag, grid.mag, grid.vsini, keep=cf.obs_store != 'unary')
 	# largest companions may be so close to TAMS that magnitude differences in the r dimension are too large
-	ind = np.argwhere( ~np.less_equal(dm, cf.dmax * cf.std[0], where=~np.isnan(dm)) ).flatten()
+	m = np.zeros(dm.shape, dtype=bool)
+	np.greater(dm, cf.dmax * cf.std[0], where=~np.isnan(dm), out=m)
+	ind = np.nonzero( np.any(m, axis=-1) )[0]
+	r = cf.r
 	if ind.size == 0:
 		print('all observable differences are small in the r dimension')
 	else:
@@ -158,51 +194,78 @@ for it in range(it_0, len(t)):
 		print('observable differences are small up to r = ' + str(cf.r[:-1][ind[0]]))
 		# cull the magnitude and r arrays
 		r = cf.r[:ind[0] + 1]
-		obs_binary = obs_binary[:, :ind[0] + 1, ...]
-
-	# compute the distance from the previous-age isochrone if it exists
-	if it > it_0:
-		emin = int(np.floor(min(np.nanmin(EEP_prev), np.nanmin(EEP))))
-		emax = int(np.ceil(max(np.nanmax(EEP_prev), np.nanmax(EEP))))
-		EEPrange = np.array(range(emin, emax + 1))
-		numbers = []
-		diff = []
-		for eep in EEPrange:
-			# indices of mass + omega locations in the EEP grids where EEP rounds to some integer
-			i0 = np.argwhere(np.around(EEP_prev) == eep)
-			i1 = np.argwhere(np.around(EEP) == eep)
-			# observables of corresponding models: look at all r and all i
-			obs0 = obs_binary_prev[i0.T[0], :, i0.T[1]].reshape(-1, 3)
-			obs1 = obs_binary[i1.T[0], :, i1.T[1]].reshape(-1, 3)
-			obs0 = obs0[~np.isnan(obs0[:, 0])]
-			obs1 = obs1[~np.isnan(obs1[:, 0])]
-			if obs0.shape[0] > 0 and obs1.shape[0] > 0: 
-				diff_means = np.mean(obs1, axis=0) - np.mean(obs0, axis=0)
-				numbers.append(obs0.shape[0] + obs1.shape[0])
-				diff.append(diff_means)
-		numbers = np.array(numbers)
-		diff = np.array(diff)
-		d = np.nansum(diff * numbers[:, np.newaxis], axis=0) / np.nansum(numbers)
-		print('magnitude, color, vsini minimum-error distances from the previous isochrone: ' +\
-			', '.join('%.4f' % x for x in d/cf.std))
-
-	# make copies of observables and EEPs for the next iteration
-	if it > it_0: del obs_binary_prev # mark the old version of previous observables for garbage collection
-	obs_binary_prev = obs_binary.copy()
-	EEP_prev = EEP.copy()
-
+		if obs_binary is not None: obs_binary = obs_binary[:, :ind[0] + 1, ...]
 	print('%.2f' % (time.time() - start) + ' seconds.', flush=True)
 
-	# save the binary observables
-	with open(cf.obs_dir + 'obs' + t_str + '.pkl', 'wb') as f:
-		pickle.dump([obs_binary, t[it], grid.Mini, r, grid.omega0, grid.inc], f)
+	# save the binary observables, or the unary models and the companion magnitudes from which they are computed
+	if cf.obs_store == 'unary':
+		ou.save_unary(ou.obs_dir(cf, age), grid.mag, grid.vsini, mag[:, :len(r)], \
+			age, grid.Mini, r, grid.omega0, grid.inc, cf=cf)
+	else:
+		ou.save(ou.obs_dir(cf, age), obs_binary, age, grid.Mini, r, grid.omega0, grid.inc, cf=cf)
+	# save the summary for the diagnostics, reduced over blocks of r, which are views of the binary observables
+	# or are computed from the unary models, as when they are read
+	nr = cf.obs_chunk[0]
+	if obs_binary is None:
+		blocks = ( (slice(k, k + ob.shape[1]), ob.astype(np.float32)) \
+			for k, ob in ou.binary_blocks(mag[:, :len(r)], grid.mag, grid.vsini, nr=nr) )
+	else:
+		blocks = ( (slice(k, min(k + nr, len(r))), obs_binary[:, k:k + nr]) for k in range(0, len(r), nr) )
+	summary = dg.summary(blocks, EEP, age, grid.Mini, r, grid.omega0, grid.inc, cf=cf)
+	dg.save(ou.obs_dir(cf, age), summary)
+	return grid, summary
+
+# arguments that forked worker processes share with the parent process without copying:
+# configuration, catalog, primary and non-rotating model sets, ages; the PARS grid is shared as mu.Grid.pars
+shared = None
+
+# compute the observables at an age in a worker process; returns the age index, the omega and inclination grids,
+# and the summary of the observables, whether the refinement stalled and the checksum of the outputs for the manifest
+def age_worker(args):
+	it, o0, inc = args
+	cf, ld, st, stc, t = shared
+	print('\nt = ' + '%.4f' % t[it], flush=True)
+	grid, summary = calc_age(cf, ld, st, stc, t[it], o0=o0, inc=inc)
+	return it, grid.omega0, grid.inc, summary, grid.stalled, ou.checksum(ou.obs_dir(cf, t[it]))
+
+# Compute the observables at all ages on a pool of forked processes:
+# first at the MIST grid ages, then at the intermediate ages, 
+# with the omega and inclination grids of the preceding MIST grid age;
+# then compute the distances between consecutive isochrones from the saved summaries;
+# ages with complete observables in the manifest are skipped, the manifest records each age as it completes
+def calc_ages_parallel(cf, ld, st, stc, t, t_orig, manifest):
+	global shared
+	shared = (cf, ld, st, stc, t)
+	done = [ manifest.complete(age) for age in t ]
+	iorig = [ it for it in range(len(t)) if t_orig[it] ]
+	inter = [ it for it in range(len(t)) if not t_orig[it] and not done[it] ]
+	# omega and inclination grids at the MIST grid ages; those of complete ages are in the metadata
+	res = {}
+	for it in iorig:
+		if done[it]:
+			obs = ou.Obs(ou.obs_dir(cf, t[it]))
+			res[it] = (obs.omega0, obs.inc)
+	with multiprocessing.get_context('fork').Pool(cf.nproc) as pool:
+		args = [ (it, None, None) for it in iorig if not done[it] ]
+		for it, o0, inc, summary, stalled, digest in pool.imap_unordered(age_worker, args, chunksize=1):
+			res[it] = (o0, inc)
+			manifest.record(t[it], summary, stalled, digest)
+		args = []
+		for it in inter:
+			j = max(i for i in iorig if i < it) # the preceding MIST grid age
+			args.append( (it, res[j][0], res[j][1]) )
+		for it, o0, inc, summary, stalled, digest in pool.imap_unordered(age_worker, args, chunksize=1):
+			manifest.record(t[it], summary, stalled, digest)
+	shared = None
 
-	# mark large variables for cleanup
-	del mag_binary
-	del obs_binary
-	gc.collect() # collect garbage / free up memory    
-	# # look at the sizes of the largest variables
-	# for name, size in sorted(((name, sys.getsizeof(value)) for name, value in locals().items()),
-	# 						 key= lambda x: -x[1])[:10]:
-	# 	print("{:>30}: {:>8}".format(name, mu.sizeof_fmt(size)))
+	# distances from the previous-age isochrones
+	for it in range(len(t)):
+		summary = dg.load(ou.obs_dir(cf, t[it]))
+		if it > 0:
+			d = dg.isochrone_distance(summary_prev, summary, cf=cf)
+			print('t = ' + '%.4f' % t[it] + ': magnitude, color, vsini minimum-error distances ' +\
+				'from the previous isochrone: ' + ', '.join('%.4f' % x for x in d))
+		summary_prev = summary
 
+if __name__ == '__main__':
+	main()
@@ -1,102 +1,200 @@
+import hashlib
 import numpy as np
 
-# directories
-dens_dir = 'data/densities/pkl/'
-obs_dir = 'data/observables/'
-points_dir = 'data/points/'
-like_dir = 'data/likelihoods/'
-
-# cluster parameters
-A_V = 0.26315789 # should be one of the A_V values on the PARS grid 
-modulus = 18.45
-Z = -0.45 # -0.37 # MIST metallicity 
-z_str = '_Z' + str(Z).replace('-', 'm').replace('.', 'p') # metallicity string for printing
-
-## parameters for the point density calculations
-mix = False # True if mixing grids of different ages, False if implementing a Gaussian age prior
-
-# minimum standard deviations of the observables:
-# magnitude F555W, color F435W - F814W and vsini in km/s
-std = np.array([0.01, 0.01*np.sqrt(2.), 10.])
-
-# coordinate limits in color-magnitude-vsini space that select for real main sequence stars 
-# close to the turn-off; the observables are
-# 	0: magnitude F555W,
-# 	1: color F435W - F814W,
-# 	2: vsini. 
-# The region of interest (ROI) will then be the intersection of the observables grid
-# with the closed cube defined here.
-ROI = np.array( [[19.5, 22.], [0.4, 1.0], [0., 280.]] )
-norm = [True, True, False] # in which dimensions the foreground distributions are normalized on the ROI
-volume = np.prod(np.diff(ROI, axis=-1)[:, 0]) # volume of the ROI
-volume_cm = np.prod(np.diff(ROI, axis=-1)[:-1, 0]) # volume of the CMD ROI
-v0err = 5 # standard deviation at the vsini = 0 boundary, in units of minimum standard deviation
-
-# s, such that magnitude = s * (-2.5 * log_10(initial mass)) for a given metallicity
-s = 4.6 
-# maximum number of smallest observable space standard deviations in between models in each model dimension
-dmax = 3.
-# number of steps in the binary mass ratio r that ensures that magnitude differences between 
-# adjacent values of r are mostly less than the maximum allowed number of smallest magnitude standard deviations
-num_r = int((2.5 / np.log(10)) * (1 / (dmax * std[0]))) + 30 # adjust the additive term as necessary
-# binary mass ratio spaced so that magnitudes are spaced evenly
-r = np.linspace(0, 1, num_r)**(1 / s)
-# refinement factor for the grid over which the first convolution is performed
-downsample = 3
-# the number of standard deviations to assume for the truncation of Gaussian kernels in 
-# alotting data space for all integrations with error kernels and plotting; 
-# actual Gaussian kernels will be truncated at one less deviation 
-nsig = 4
-# number of coarse vsini grid steps (approximately the minimum vsini errors) in the standard deviation 
-# of kernels alotted for the initial convolution and subsequent de-normalization tests
-denorm_err = 9
-# number of coarse vsini grid steps in the standard deviation of kernels assumed for plotting
-plot_err = 1
-
-if mix: # if enhanced rotational longevity analysis
-	# implement a single rotational population, with a flat prior
-	om_mean = np.array([1.])
-	om_sigma = np.array([np.inf])
-	om_str = ''
-else: # implement three rotational populations 
-	# slowest rotational population is centered on omega = 0, fastest on omega = 1
-	# standard deviations of the rotational populations
-	s_slow = 0.5 
-	s_middle = 0.2
-	s_fast = 0.05 
-	a = s_fast / s_slow
-	# medium rotating population: 
-	# mean is the location where the slow and fast distributions are equal
-	if a == 1:
-		om_middle = 1./2
-	else:
-		om_middle = ( 1 - a * np.sqrt(1 - 2*(1 - a**2)*np.log(a)*s_slow**2) ) / (1 - a**2)
-	om_mean = np.array([0, om_middle, 1])
-	om_sigma = np.array([s_slow, s_middle, s_fast])
-	om_str = '_os' + '_'.join([('%.2f' % n).replace('.','') for n in om_sigma])
-
-# multiplicity populations
-mult = ['unary', 'binary']
-
-# rotational and multiplicity populations for printing
-rot_pop = ['Slow', 'Intermediate', 'Fast']
-mul_pop = ['Unaries', 'Binaries']
-
-## parameters for the likelihood calculations
-overflow = 'root' # 'root' or 'log': strategy for dealing with product overflow, 'log' takes about twice the time of 'root'
-
-## target ranges
-if mix: # the enhanced mixing analysis
-	n = 11 # number of steps in each dimension
-	t0min, t0max = [9.224, 9.284]
-	amin, amax = [0.2, 0.4]
-	a_ar = np.linspace(amin, amax, n)
-else: # the MIST analysis
-	n = 21 # number of steps in each dimension
-	tmin, tmax = [9.154, 9.165] # age
-	smin, smax = [0.036, 0.047] # sigma_age
-	w0min, w0max = [0.025, 0.225] # slow proportion, age spread
-	w1min, w1max = [0.4, 0.9] # fast proportion, age spread
-	# rotational proportion grids (age parameter grids determined elsewhere)
-	w0 = np.linspace(w0min, w0max, n, dtype=float) 
-	w1 = np.linspace(w1min, w1max, n, dtype=float)
\ No newline at end of file
+# a configuration of the pipeline: cluster parameters and parameters of the calculations;
+# keyword arguments override the default values of the independent parameters,
+# e.g. Config(Z=-0.37, A_V=0.3), after which the dependent parameters are re-computed;
+# the module-level variables below are those of the default configuration, e.g. config.Z
+class Config:
+	def __init__(self, **kwargs):
+		# directories
+		self.dens_dir = 'data/densities/pkl/'
+		self.obs_dir = 'data/observables/'
+		self.points_dir = 'data/points/'
+		self.like_dir = 'data/likelihoods/'
+		# directory of the densities, the points and the likelihoods of the enhanced mixing analysis, see mix
+		self.mix_dir = 'data/mix/'
+
+		# cluster parameters
+		self.A_V = 0.26315789 # should be one of the A_V values on the PARS grid
+		self.modulus = 18.45
+		self.Z = -0.45 # -0.37 # MIST metallicity
+
+		## parameters for the point density calculations
+		self.mix = False # True if mixing grids of different ages, False if implementing a Gaussian age prior
+
+		# minimum standard deviations of the observables:
+		# magnitude F555W, color F435W - F814W and vsini in km/s
+		self.std = np.array([0.01, 0.01*np.sqrt(2.), 10.])
+
+		# coordinate limits in color-magnitude-vsini space that select for real main sequence stars
+		# close to the turn-off; the observables are
+		# 	0: magnitude F555W,
+		# 	1: color F435W - F814W,
+		# 	2: vsini.
+		# The region of interest (ROI) will then be the intersection of the observables grid
+		# with the closed cube defined here.
+		self.ROI = np.array( [[19.5, 22.], [0.4, 1.0], [0., 280.]] )
+		self.norm = [True, True, False] # in which dimensions the foreground distributions are normalized on the ROI
+		self.v0err = 5 # standard deviation at the vsini = 0 boundary, in units of minimum standard deviation
+
+		# s, such that magnitude = s * (-2.5 * log_10(initial mass)) for a given metallicity
+		self.s = 4.6
+		# how the prior of each model is placed on the grid of observables: 'nearest' at the grid point at or below it,
+		# 'linear' at the corners of its grid cell with multilinear (cloud-in-cell) weights
+		self.deposit = 'nearest'
+		# maximum number of smallest observable space standard deviations in between models in each model dimension;
+		# None for the default of the deposition, which is larger for linear deposition
+		self.dmax = None
+		# additive term in the number of steps in the binary mass ratio; adjust as necessary
+		self.num_r_add = 30
+		# refinement factor for the grid over which the first convolution is performed
+		self.downsample = 3
+		# the number of standard deviations to assume for the truncation of Gaussian kernels in
+		# alotting data space for all integrations with error kernels and plotting;
+		# actual Gaussian kernels will be truncated at one less deviation
+		self.nsig = 4
+		# number of coarse vsini grid steps (approximately the minimum vsini errors) in the standard deviation
+		# of kernels alotted for the initial convolution and subsequent de-normalization tests
+		self.denorm_err = 9
+		# number of coarse vsini grid steps in the standard deviation of kernels assumed for plotting
+		self.plot_err = 1
+		# maximum number of refinements of the model grid at one age, after which the refinement stops
+		# with the grid that has the smallest maximum observable difference so far
+		self.refine_iter = 1000
+		# whether to plot maximum observable differences versus model parameters on the refined model grids
+		self.plot_model_grids = False
+		# maximum number of points in one interpolation from the PARS grid, which bounds the memory it takes
+		self.pars_chunk = 2**16
+		# number of threads for interpolation from the PARS grid and for convolutions; None for the number of processors
+		self.nthreads = None
+		# method of convolutions on the grids of observables: 'direct', 'fft', 'strided' or 'iir', see dens_util.convolve(); 
+		# None to choose by kernel width, downsample factor and axis; 'iir' is approximate and is never chosen
+		self.conv_method = None
+		# minimum number of points in a kernel for which convolutions are computed with FFTs, when the method is chosen
+		self.conv_fft_min = 64
+		# number of processes that compute the observables at different ages; 1 to compute them in sequence
+		self.nproc = 1
+		# minimum number of masses in the tables of non-rotating companion magnitudes
+		self.companion_nm = 2000
+		# numbers of binary mass ratios and initial omegas in the chunks of saved observables;
+		# the unary models are saved in chunks of their own
+		self.obs_chunk = [8, 16]
+		# whether to compress the saved observables, which is lossless but precludes memory-mapping
+		self.obs_compress = False
+		# which observables to save: 'binary' for the observables of all binary models, 'unary' for those of 
+		# unary models and the companion magnitudes, from which the binary models are computed when they are read
+		self.obs_store = 'binary'
+
+		# standard deviations of the rotational populations, when not mixing isochrones of different ages;
+		# slowest rotational population is centered on omega = 0, fastest on omega = 1
+		self.s_slow = 0.5
+		self.s_middle = 0.2
+		self.s_fast = 0.05
+		# standard deviations [slow, middle, fast] of the rotational populations in each set of a sweep,
+		# whose point densities calc_dens computes in one pass over the models; None for the set above
+		self.om_sweep = None
+
+		## parameters for the likelihood calculations
+		self.overflow = 'root' # 'root' or 'log': strategy for dealing with product overflow, 'log' takes about twice the time of 'root'
+
+		## target ranges
+		# the enhanced mixing analysis
+		self.t0min, self.t0max = [9.224, 9.284]
+		self.amin, self.amax = [0.2, 0.4]
+		# the MIST analysis
+		self.tmin, self.tmax = [9.154, 9.165] # age
+		self.smin, self.smax = [0.036, 0.047] # sigma_age
+		self.w0min, self.w0max = [0.025, 0.225] # slow proportion, age spread
+		self.w1min, self.w1max = [0.4, 0.9] # fast proportion, age spread
+
+		for name, value in kwargs.items():
+			if not hasattr(self, name):
+				raise AttributeError('unknown configuration parameter: ' + name)
+			setattr(self, name, value)
+		self.set_vars()
+
+	# compute the parameters that depend on the others
+	def set_vars(self):
+		std = self.std
+		ROI = self.ROI
+		self.z_str = '_Z' + str(self.Z).replace('-', 'm').replace('.', 'p') # metallicity string for printing
+		self.volume = np.prod(np.diff(ROI, axis=-1)[:, 0]) # volume of the ROI
+		self.volume_cm = np.prod(np.diff(ROI, axis=-1)[:-1, 0]) # volume of the CMD ROI
+		if self.dmax is None: self.dmax = {'nearest': 3., 'linear': 6.}[self.deposit]
+		# number of steps in the binary mass ratio r that ensures that magnitude differences between
+		# adjacent values of r are mostly less than the maximum allowed number of smallest magnitude standard deviations
+		self.num_r = int((2.5 / np.log(10)) * (1 / (self.dmax * std[0]))) + self.num_r_add
+		# binary mass ratio spaced so that magnitudes are spaced evenly
+		self.r = np.linspace(0, 1, self.num_r)**(1 / self.s)
+
+		if self.mix: # if enhanced rotational longevity analysis
+			# implement a single rotational population, with a flat prior
+			self.om_mean = np.array([1.])
+			self.om_sigma = np.array([np.inf])
+			self.om_str = ''
+		else: # implement three rotational populations
+			self.om_mean, self.om_sigma = self.rot_pops(self.s_slow, self.s_middle, self.s_fast)
+			self.om_str = '_os' + '_'.join([('%.2f' % n).replace('.','') for n in self.om_sigma])
+		# means and standard deviations of the rotational populations in the sets for which
+		# the point densities are computed
+		if self.mix or self.om_sweep is None: self.om_sets = [(self.om_mean, self.om_sigma)]
+		else: self.om_sets = [ self.rot_pops(*s) for s in self.om_sweep ]
+
+		# multiplicity populations
+		self.mult = ['unary', 'binary']
+
+		# rotational and multiplicity populations for printing
+		self.rot_pop = ['Slow', 'Intermediate', 'Fast']
+		self.mul_pop = ['Unaries', 'Binaries']
+
+		## target ranges
+		if self.mix: # the enhanced mixing analysis
+			self.n = 11 # number of steps in each dimension
+			self.a_ar = np.linspace(self.amin, self.amax, self.n)
+		else: # the MIST analysis
+			self.n = 21 # number of steps in each dimension
+			# rotational proportion grids (age parameter grids determined elsewhere)
+			self.w0 = np.linspace(self.w0min, self.w0max, self.n, dtype=float)
+			self.w1 = np.linspace(self.w1min, self.w1max, self.n, dtype=float)
+
+	# means and standard deviations of the slow, middle and fast rotational populations,
+	# given their standard deviations
+	def rot_pops(self, s_slow, s_middle, s_fast):
+		a = s_fast / s_slow
+		# medium rotating population:
+		# mean is the location where the slow and fast distributions are equal
+		if a == 1:
+			om_middle = 1./2
+		else:
+			om_middle = ( 1 - a * np.sqrt(1 - 2*(1 - a**2)*np.log(a)*s_slow**2) ) / (1 - a**2)
+		# slowest rotational population is centered on omega = 0, fastest on omega = 1
+		return np.array([0, om_middle, 1]), np.array([s_slow, s_middle, s_fast])
+
+	# parameters on which the observables depend, directly or through the catalog's observables grids;
+	# configurations with the same values of these have the same observables
+	obs_params = ['Z', 'A_V', 'modulus', 'std', 'ROI', 'nsig', 'denorm_err', 'downsample', 'dmax', 'r',
+		'companion_nm', 'refine_iter', 'obs_store', 'obs_chunk', 'obs_compress']
+
+	# digest of the values of the parameters on which the observables depend
+	def obs_key(self):
+		values = [ np.asarray(getattr(self, name)).tolist() for name in self.obs_params ]
+		return hashlib.sha256(repr(values).encode()).hexdigest()[:16]
+
+	# directories that the densities, the points and the likelihoods of this configuration are written to
+	def out_dirs(self):
+		if self.mix: return [ self.mix_dir + d for d in ['densities/pkl/', 'points/', 'likelihoods/pkl/'] ]
+		return [self.dens_dir, self.points_dir, self.like_dir + 'pkl/']
+
+	# file name of the PARS grid at this metallicity
+	def pars_file(self):
+		return 'data/pars_grid_ZM' + str(self.Z).replace('-', 'm').replace('.', 'p') + '.pkl'
+
+# the default configuration
+default = Config()
+# module-level parameters of the default configuration
+globals().update(vars(default))
+pars_file = default.pars_file
+obs_params = default.obs_params
+obs_key = default.obs_key
+out_dirs = default.out_dirs
@@ -2,11 +2,17 @@
 # of observables
 import load_data as ld
 import config as cf
+import os, copy, itertools, functools
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import numba as nb
+try:
+	import numba as nb
+except ImportError: # the strided and recursive convolutions are then unavailable, see conv_method()
+	nb = None
 from scipy.ndimage import convolve1d
+from scipy.signal import oaconvolve
 from scipy.interpolate import interp1d
-import copy
+from scipy.special import ndtr
 
 # given a set of likelihoods / probability densities, their integration weights and the proportion
 # of probability expected to be outside the observed domain,
@@ -41,6 +47,146 @@ def trap(x):
 		d = np.array([0.0])
 	return d
 
+# Flat indices of models in the grid of observables, i.e. the indices of the grid points at or below the models;
+# the grids are uniform, so the index in each dimension is an affine floor,
+# fixed up where round-off puts it on the wrong side of a grid point;
+# this gives the same indices as np.searchsorted(grid, x, side='right') - 1
+# Inputs:
+#	observables; the last dimension is the observable
+#	grids of observables
+#	whether to also return the fractional positions of the models in their grid cells
+# Output: flat indices in the grid of observables; -1 for models that are NAN, below the grid,
+#	or at or above its last grid point;
+#	optionally, the fractional positions in [0, 1), with the observable in the last dimension
+def flat_index(obs, grids, frac=False):
+	ind = np.zeros(obs.shape[:-1], dtype=np.int64)
+	valid = np.ones(obs.shape[:-1], dtype=bool)
+	if frac: f = np.zeros(obs.shape, dtype=np.float32)
+	for i, g in enumerate(grids):
+		n = len(g)
+		x = obs[..., i].astype(float)
+		with np.errstate(invalid='ignore'):
+			j = np.floor( (x - g[0]) / (g[1] - g[0]) )
+			j = np.clip(np.nan_to_num(j, nan=-1), -1, n - 1).astype(np.int64)
+			# fix-up at the grid points
+			up = (j < n - 1) & (x >= g[np.minimum(j + 1, n - 1)])
+			j[up] += 1
+			down = (j >= 0) & (x < g[np.maximum(j, 0)])
+			j[down] -= 1
+		valid &= (j >= 0) & (j < n - 1) & ~np.isnan(x)
+		ind = ind * n + j
+		if frac: 
+			with np.errstate(invalid='ignore'):
+				f[..., i] = np.clip( (x - g[np.clip(j, 0, n - 1)]) / (g[1] - g[0]), 0, 1 )
+	ind[~valid] = -1
+	if frac: return ind, f
+	return ind
+
+# unary (r = 0) and binary (r > 0) parts of an array on the model grid in a block of r
+def split_unary(rs, x):
+	if rs.start == 0: return x[:, :1], x[:, 1:]
+	else: return x[:, :0], x
+
+# Placement of the priors of models on the grid of observables;
+# the models are placed block by block, e.g. in the blocks of r from obs_util.Obs.blocks(),
+# and the priors of all the channels, e.g. the rotational populations, are summed with np.bincount
+# over the grid points with models in the block, then added to the sums over the grid points with models so far;
+# only the grid points with models and the sums of the priors at them are kept, not the indices of the models.
+# The prior of a model is placed either at the grid point at or below it, 
+# or, with linear (cloud-in-cell) deposition, at the corners of its grid cell, with multilinear weights;
+# the latter places the mean of the prior of each model at the model, 
+# so that models may be further apart in observable space for the same accuracy of the densities
+class Deposit:
+	# Inputs:
+	#	observables in blocks of the binary mass ratio, e.g. from obs_util.Obs.blocks();
+	#		dimensions of each block: initial mass, r, initial omega, inclination, observable;
+	#		with None, the blocks are placed one by one with place(), e.g. by deposits()
+	#	grids of observables
+	#	function that gives the prior without the initial omega prior on the model grid in a slice of r
+	#	initial omega priors of the channels; dimensions: channel, initial omega
+	#	whether to sum the priors of binary models
+	#	whether to deposit linearly
+	def __init__(self, blocks, grids, prior, pr_om, binary=True, linear=False):
+		self.grids = grids
+		self.prior = prior
+		self.pr_om = np.asarray(pr_om, dtype=float)
+		self.binary = binary
+		self.linear = linear
+		self.shape = tuple(len(g) for g in grids)
+		if linear:
+			# corners of a grid cell and their offsets in the flat grid
+			self.corners = np.array(list(itertools.product([0, 1], repeat=len(grids))))
+			self.offset = self.corners @ np.cumprod((1,) + self.shape[:0:-1])[::-1]
+		self.bins = np.zeros(0, dtype=np.int64) # grid points with models
+		# sums of the priors of unary models and of binary models at r > 0 over the grid points with models;
+		# dimensions: unary or binary, channel, grid point with models
+		self.sums = np.zeros( (2, len(self.pr_om), 0) )
+		if blocks is not None:
+			for rs, obs in blocks: self.place(rs, obs)
+
+	# place the models in a block of r on the grid; only the first observables, those of the grids, are used
+	def place(self, rs, obs):
+		if not self.binary and rs.start > 0: return
+		obs = obs[..., :len(self.grids)]
+		if self.linear: i, f = flat_index(obs, self.grids, frac=True)
+		else: i, f = flat_index(obs, self.grids), None
+		m = i >= 0
+		pr = np.broadcast_to(self.prior(rs), m.shape)
+		o = np.broadcast_to(np.arange(m.shape[2])[np.newaxis, np.newaxis, :, np.newaxis], m.shape)
+		# flat indices, priors and initial omega indices of the unary and the binary models in the grid
+		ind, w, iom = [ [ x[y] for x, y in zip(split_unary(rs, a), split_unary(rs, m)) ] for a in [i, pr, o] ]
+		if not self.binary: ind, w, iom = ind[:1], w[:1], iom[:1]
+		if self.linear:
+			# dimensions: corner, model
+			cw = [ np.prod(np.where(self.corners[:, np.newaxis, :], x[np.newaxis], 1 - x[np.newaxis]), axis=-1) \
+				for x in [ y[z] for y, z in zip(split_unary(rs, f), split_unary(rs, m)) ][:len(ind)] ]
+			ind = [ (x[np.newaxis, :] + self.offset[:, np.newaxis]).ravel() for x in ind ]
+		# grid points with models in the block, and the index of each model (or corner) among them
+		n0 = ind[0].size
+		bins, inv = np.unique(np.concatenate(ind), return_inverse=True)
+		inv = [ inv[:n0], inv[n0:] ]
+		sums = np.zeros( (2, len(self.pr_om), len(bins)) )
+		for k in range(len(ind)):
+			for c, p in enumerate(self.pr_om):
+				x = w[k] * p[iom[k]]
+				if self.linear: x = (cw[k] * x[np.newaxis, :]).ravel()
+				sums[k, c] = np.bincount(inv[k], weights=x, minlength=len(bins))
+		self.accumulate(bins, sums)
+
+	# add sums over sorted grid points with models to the sums so far;
+	# the grid points that are new are inserted in order, with zero sums
+	def accumulate(self, bins, sums):
+		pos = np.searchsorted(self.bins, bins)
+		new = self.bins[np.minimum(pos, len(self.bins) - 1)] != bins if len(self.bins) > 0 else np.ones(len(bins), bool)
+		if np.any(new):
+			self.bins = np.insert(self.bins, pos[new], bins[new])
+			self.sums = np.insert(self.sums, pos[new], 0., axis=-1)
+			pos = np.searchsorted(self.bins, bins)
+		self.sums[..., pos] += sums
+
+	# Sums of the priors of the channels over the grid points with models
+	# Output: sums of the priors of unary models and of binary models, the latter None if not requested;
+	#	the binary prior is the unary prior plus the contribution at r > 0;
+	#	dimensions: channel, grid point with models, in the order of self.bins
+	def channels(self):
+		return self.sums[0], self.sums[0] + self.sums[1] if self.binary else None
+
+	# density on the grid of observables from sums over the grid points with models, e.g. a channel from channels()
+	def grid(self, p, dtype=np.float32):
+		dens = np.zeros(self.shape, dtype=dtype)
+		dens.flat[self.bins] = p
+		return dens
+
+# Placements of models on several grids of observables, from one pass over the blocks of observables,
+# which are then read or computed once; each list of grids is that of the first observables,
+# e.g. all the observables and the magnitude and color of the CMD;
+# the other inputs are those of Deposit
+def deposits(blocks, grids, prior, pr_om, binary=True, linear=False):
+	deps = [ Deposit(None, g, prior, pr_om, binary=binary, linear=linear) for g in grids ]
+	for rs, obs in blocks:
+		for d in deps: d.place(rs, obs)
+	return deps
+
 class ConvolutionException(Exception):
     pass
 
@@ -57,17 +203,151 @@ class Kernel:
 		x = np.linspace(-n, n, 2 * n + 1) # abscissae
 		y = np.exp(-0.5 * (x/sigma)**2)
 		self.y = y / np.sum(y) # normalize the kernel
+		self.y.flags.writeable = False # kernels are shared, see kernel()
 		self.n = n
+		self.sigma = sigma
+
+# kernel with given standard deviation, extent and downsample factor; 
+# kernels are memoized, since the same ones are used for all populations and ages
+@functools.lru_cache(maxsize=None)
+def kernel(sigma, nsig, ds:int=1):
+	return Kernel(sigma, nsig, ds)
+
+# compile a function with numba, parallel over its prange loops, if numba is installed
+def njit(func):
+	return func if nb is None else nb.njit(parallel=True, cache=True)(func)
+
+# Convolution with a kernel along the middle dimension of a three-dimensional array, 
+# computed only at every ds-th point where the kernel fits in the array, accumulating in double precision;
+# parallel over the first dimension
+@njit
+def conv_strided(d, y, ds, m):
+	pre, n, post = d.shape
+	out = np.empty((pre, m, post), dtype=d.dtype)
+	for p in nb.prange(pre):
+		acc = np.empty(post)
+		for i in range(m):
+			acc[:] = 0.
+			for j in range(len(y)):
+				w = y[j]
+				for q in range(post):
+					acc[q] += w * d[p, i * ds + j, q]
+			for q in range(post):
+				out[p, i, q] = acc[q]
+	return out
+
+# the same along the last dimension of a two-dimensional array
+@njit
+def conv_strided_last(d, y, ds, m):
+	pre, n = d.shape
+	out = np.empty((pre, m), dtype=d.dtype)
+	for p in nb.prange(pre):
+		for i in range(m):
+			acc = 0.
+			for j in range(len(y)):
+				acc += y[j] * d[p, i * ds + j]
+			out[p, i] = acc
+	return out
+
+# Recursive approximation of convolution with a Gaussian of a given standard deviation, in steps,
+# along the middle dimension of a three-dimensional array (Young & van Vliet 1995); 
+# the array is zero outside its boundaries
+@njit
+def conv_iir(d, sigma):
+	if sigma >= 2.5: q = 0.98711 * sigma - 0.96330
+	else: q = 3.97156 - 4.14554 * np.sqrt(1 - 0.26891 * sigma)
+	b0 = 1.57825 + 2.44413 * q + 1.4281 * q**2 + 0.422205 * q**3
+	b1 = (2.44413 * q + 2.85619 * q**2 + 1.26661 * q**3) / b0
+	b2 = -(1.4281 * q**2 + 1.26661 * q**3) / b0
+	b3 = 0.422205 * q**3 / b0
+	B = 1 - (b1 + b2 + b3)
+	pre, n, post = d.shape
+	out = np.empty(d.shape, dtype=d.dtype)
+	for p in nb.prange(pre):
+		w = np.zeros(n + 6)
+		for q in range(post):
+			for i in range(n): # forward
+				w[i + 3] = B * d[p, i, q] + b1 * w[i + 2] + b2 * w[i + 1] + b3 * w[i]
+			w[n + 3:] = 0
+			for i in range(n - 1, -1, -1): # backward
+				w[i + 3] = B * w[i + 3] + b1 * w[i + 4] + b2 * w[i + 5] + b3 * w[i + 6]
+				out[p, i, q] = w[i + 3]
+			w[:] = 0
+	return out
+
+# Apply a function to slabs of an array along the longest axis other than a given one, on a thread pool,
+# and join the results; with one thread, apply it to the whole array
+def slabs(func, a, axis, nthreads=None):
+	n = os.cpu_count() if nthreads is None else nthreads
+	other = [ i for i in range(a.ndim) if i != axis % a.ndim ]
+	if n <= 1 or len(other) == 0: return func(a)
+	i = max(other, key=lambda i: a.shape[i])
+	bounds = np.linspace(0, a.shape[i], min(n, a.shape[i]) + 1).astype(int)
+	index = [ (slice(None),) * i + (slice(bounds[k], bounds[k + 1]),) for k in range(len(bounds) - 1) ]
+	with ThreadPoolExecutor(max_workers=n) as executor:
+		res = list(executor.map(lambda idx: func(a[idx]), index))
+	return np.concatenate(res, axis=i)
+
+# Choose the method of a convolution with a kernel along an axis, followed by downsampling:
+# FFTs for wide kernels; otherwise, direct convolution along the last, contiguous axis of an array without downsampling, 
+# and strided convolution that only computes the downsampled points in other cases, or FFTs without numba
+def conv_method(shape, axis, kernel, ds:int=1, cf=cf):
+	if cf.conv_method is not None: return cf.conv_method
+	if 2 * kernel.n + 1 >= cf.conv_fft_min: return 'fft'
+	if ds == 1 and axis % len(shape) == len(shape) - 1: return 'direct'
+	return 'strided' if nb is not None else 'fft'
+
+# Convolve an array with a kernel along an axis, remove the strip on each side equal to one half of the kernel, 
+# where there are edge effects, and downsample
+# Inputs:
+#	array
+#	axis along which to convolve
+# 	a kernel to convolve with
+#	downsample factor (an integer)
+#	method: 'direct' (ndimage), 'fft' (overlap-add), 'strided' (only at the downsampled points),
+#		'iir' (recursive approximation of the Gaussian, which is not truncated); None to choose with conv_method();
+#		'strided' and 'iir' need numba
+#	configuration, which sets the automatic choice of method and the number of threads
+# Output: the result, with the same type as the array
+def convolve(dens, axis, kernel, ds:int=1, method=None, cf=cf):
+	axis = axis % dens.ndim
+	if method is None: method = conv_method(dens.shape, axis, kernel, ds, cf=cf)
+	n = kernel.n
+	m = len(range(0, dens.shape[axis] - 2 * n, ds)) # number of points in the result along the axis
+	if method in ['strided', 'iir']:
+		if nb is None: raise ConvolutionException('the ' + method + ' convolution needs numba, which is not installed')
+		if cf.nthreads is not None: nb.set_num_threads(max(1, min(cf.nthreads, nb.config.NUMBA_NUM_THREADS)))
+	# the array as three dimensions, with the focal one in the middle
+	shape3 = (int(np.prod(dens.shape[:axis])), dens.shape[axis], int(np.prod(dens.shape[axis + 1:])))
+	shape = dens.shape[:axis] + (m,) + dens.shape[axis + 1:]
+	index = (slice(None),) * axis + (slice(n, dens.shape[axis] - n, ds),)
+	if method == 'direct':
+		res = slabs(lambda a: convolve1d(a, kernel.y, axis=axis, mode='constant')[index], dens, axis, cf.nthreads)
+	elif method == 'fft':
+		y = kernel.y.astype(dens.dtype).reshape( (1,) * axis + (-1,) + (1,) * (dens.ndim - axis - 1) )
+		res = slabs(lambda a: oaconvolve(a, y, mode='valid', axes=axis)[(slice(None),) * axis + (slice(None, None, ds),)], 
+			dens, axis, cf.nthreads)
+	elif method == 'strided':
+		d = np.ascontiguousarray(dens)
+		if shape3[2] == 1: res = conv_strided_last(d.reshape(shape3[:2]), kernel.y, ds, m)
+		else: res = conv_strided(d.reshape(shape3), kernel.y, ds, m)
+	elif method == 'iir':
+		res = conv_iir(np.ascontiguousarray(dens).reshape(shape3), kernel.sigma)[:, n:shape3[1] - n:ds]
+	else:
+		raise ValueError('unknown convolution method: ' + str(method))
+	return res.reshape(shape)
 
 # run this function with the first convolved prior as the argument
-# to obtain the kernels and corresponding slices necessary for individual-star error integrations
-def calc_kernels(density, sigma, nsig):
+# to obtain the kernels and corresponding slices necessary for individual-star error integrations;
+# the data points are those of a catalog, e.g. the load_data module;
+# the prior may be a CMD density if no data points have vsini
+def calc_kernels(density, sigma, nsig, ld=ld):
 	npts = ld.obs.shape[0] # number of data points
 	ndim = ld.obs.shape[1] # number of observable dimensions
 	# fractional indices of data points in observables arrays, 
 	# a.k.a. observables of stars in pixels, offset by the zero-indexed observable
-	obs = np.empty_like(ld.obs, dtype=float)
-	for j in range(ndim):
+	obs = np.full_like(ld.obs, np.nan, dtype=float)
+	for j in range(density.dim):
 		obs[:, j] = (ld.obs[:, j] - density.obs[j][0]) / density.step[j]
 
 	# start and stop indices of kernels in the observables arrays
@@ -160,37 +440,41 @@ class Grid:
 		self.step = np.delete(self.step, axis)
 		self.dim -= 1
 
-	# obtain the dependence of probability leakage on standard deviations of the Gaussian kernels
-	# convolve the density with a number of Gaussian kernels on the grid of observables without downsampling
+	# obtain the dependence of probability leakage on standard deviations of the Gaussian kernels;
+	# convolving along a dimension commutes with integrating on the region of normalization in the others,
+	# so the leakage is that of the profile along the dimension, convolved with all the kernels at once
 	# Inputs:
 	# 	number of standard deviations to extend Gaussian kernels
+	#	configuration, e.g. the config module
 	# Outcome:
 	#	for normalized dimensions, updates the dependence of de-normalization on kernel standard deviation
 	# Notes:
 	#	operates on normalized, un-scaled probability density
-	def dP_sigma(self, nsig):
-		density = self.copy()
-		for i in range(len(self.obs)): # for each observable dimension
-			if not self.norm[i]: # if the dimension is not normalized in the ROI
-				density.marginalize(i) # marginalize in it
+	def dP_sigma(self, nsig, cf=cf):
 		# standard deviations in units of grid step size, up to the size
 		# that can have half a kernel fit at an edge of the ROI 
 		s = np.linspace(0.5, cf.denorm_err, 9)
-		kernels = [Kernel(s[j], nsig) for j in range(s.shape[0])]
+		kernels = [kernel(s[j], nsig) for j in range(s.shape[0])]
 		sigma = np.outer(self.step, s)	
+		# weights of the region of normalization in each dimension
+		w = [ self.w(self.ROI[i] if self.norm[i] else [-np.inf, np.inf], i) for i in range(self.dim) ]
 		for i in range(len(self.obs)): # for each observable dimension
 			if self.norm[i]: # if the dimension is normalized in the ROI
-				dp = []
-				for j in range(len(kernels)): # for each kernel width
-					kernel = kernels[j]
-					d = density.copy()
-					# check that the kernel, evaluated at the ROI boundaries, fits within the grid
-					if d.check_roi(i, kernel): 
-						d.convolve(i, kernel)
-						d.integrate_ron()
-						dp.append(d.dens - 1)
+				# profile along the dimension, integrated on the region of normalization in the others
+				p = self.dens
+				for d in reversed(range(self.dim)):
+					if d != i: p = np.tensordot(p, w[d], axes=([d], [0]))
+				# kernels that, evaluated at the ROI boundaries, fit within the grid,
+				# centered in an array of the width of the widest one
+				kern = [ k for k in kernels if self.check_roi(i, k) ]
+				n = max(k.n for k in kern)
+				y = np.zeros( (len(kern), 2 * n + 1) )
+				for j, k in enumerate(kern): y[j, n - k.n:n + k.n + 1] = k.y
+				# probability in the ROI after convolution with each kernel, minus one;
+				# the ROI is within the convolved region for each kernel
+				windows = np.lib.stride_tricks.sliding_window_view(np.pad(p.astype(float), n), 2 * n + 1)
+				dp = y @ (w[i] @ windows) - 1
 				# the dependence of log probability change on log sigma, in units of the observable
-				dp = np.array(dp)
 				x = sigma[i][:dp.shape[0]]
 				fit = interp1d(x, dp, kind='cubic', fill_value='extrapolate') # extrapolate for sigma closer to zero
 				# if maximum probability change is less than the cube root of precision (< 10^-5 for regular floats)
@@ -212,80 +496,18 @@ class Grid:
 		# drops below smallest index (zero) and similarly for the largest index
 		return (index.min() >= kernel.n) & (len(obs) - index.max() > kernel.n) 
 
-	# convolve, then downsample;
-	# uses ndimage library routines for convolution;
-	# ~6 seconds for NGC1846 with downsample = 3.
+	# convolve, then downsample; see convolve() for the methods
 	# Inputs: 
 	#	axis along which to convolve
 	# 	a kernel to convolve with
 	#	downsample factor (an integer)
+	#	method of convolution, None to choose automatically
+	#	configuration
 	# Notes:
 	# 	number of steps in one half of the kernel must be a multiple of the downsample factor 
-	def convolve(self, axis, kernel, ds:int=1):
-		dens = np.moveaxis(self.dens, axis, -1) # move the focal axis to the front
-		dens = convolve1d(dens, kernel.y, axis=-1, mode='constant')
-		# remove the strip on each side equal to one half of the kernel, where there are edge effects
-		dens = dens[..., kernel.n:-kernel.n]
-		obs = self.obs[axis][kernel.n:-kernel.n]
-		# downsample, move the focal axis back in its place and set
-		self.dens = np.moveaxis(dens[..., ::ds], -1, axis)
-		self.obs[axis] = obs[::ds]
-		# multiply step size in the focal dimension by the downsample factor
-		self.step[axis] *= ds
-
-	# convolve, then downsample;
-	# uses numpy library routines for convolution;
-	# ~13 seconds for NGC1846 with downsample = 3.
-	# Inputs: 
-	#	axis along which to convolve
-	# 	a kernel to convolve with
-	#	downsample factor (an integer)
-	# Notes:
-	# 	number of steps in one half of the kernel must be a multiple of the downsample factor 
-	def convolve_numpy(self, axis, kernel, ds:int=1):
-		dens = np.moveaxis(self.dens, axis, -1) # move the focal axis to the front
-		dens1 = np.zeros_like(dens)
-		for index, d in np.ndenumerate(dens[..., 0]):
-			dens1[index] = np.convolve(dens[index], kernel.y, mode = 'same')
-		# remove the strip on each side equal to one half of the kernel, where there are edge effects
-		dens = dens1[..., kernel.n:-kernel.n]
-		obs = self.obs[axis][kernel.n:-kernel.n]
-		# downsample, move the focal axis back in its place and set
-		self.dens = np.moveaxis(dens[..., ::ds], -1, axis)
-		self.obs[axis] = obs[::ds]
-		# multiply step size in the focal dimension by the downsample factor
-		self.step[axis] *= ds
-
-	# convolve and downsample at the same time; 
-	# use a custom routine that only computes the result at downsampled locations
-	# ~15 seconds for NGC1846 with downsample = 3; 
-	# should be more efficient for larger downsampling factors.
-	# Inputs: 
-	#	axis along which to convolve
-	# 	a kernel to convolve with
-	#	downsample factor (an integer)
-	# Notes:
-	# 	number of steps in one half of the kernel must be a multiple of the downsample factor 
-	def convolve_downsample(self, axis, kernel, ds:int=1):
-		dens = np.moveaxis(self.dens, axis, -1) # move the focal axis to the front
-		# shape of the result grid, downsampled in the focal dimension
-		shape = list(dens.shape)
-		shape[-1] = shape[-1] // ds 
-		res = np.zeros(shape) # initialize the result grid
-		# number of steps in one half of the kernel, downsampled
-		j_lim = kernel.n // ds 
-		# number of calculated downsampled points
-		n_max = shape[-1] - 2*j_lim 
-		# convolve
-		for j in range(kernel.n * 2 + 1):
-		    res[..., j_lim:-j_lim] += kernel.y[j] * dens[...,j::ds][...,:n_max]
-		# remove the strip where the convolution wasn't computed
-		res = res[...,j_lim:-j_lim]
-		# move the focal axis back in its place
-		self.dens = np.moveaxis(res, -1, axis)
-		# remove the strip where the convolution wasn't computed from the focal observable's grid, 
-		# then downsample the grid and limit it to computed points only
-		self.obs[axis] = self.obs[axis][kernel.n:-kernel.n][::ds][:n_max]
+	def convolve(self, axis, kernel, ds:int=1, method=None, cf=cf):
+		self.dens = convolve(self.dens, axis, kernel, ds=ds, method=method, cf=cf)
+		self.obs[axis] = self.obs[axis][kernel.n:-kernel.n][::ds]
 		# multiply step size in the focal dimension by the downsample factor
 		self.step[axis] *= ds
 
@@ -312,6 +534,22 @@ class Grid:
 	def integrate_upper(self, axis):
 		self.integrate([self.ROI[axis][1], np.inf], axis)
 
+	# Integral beyond the lower ROI boundary along a dimension of the density convolved with a Gaussian error
+	# of a given standard deviation, in units of the observable; the convolution and the integration 
+	# are one weighted sum with the Gaussian CDF at the upper edge of the last grid cell below the boundary;
+	# the Gaussian is not truncated, so that it need not fit within the grid.
+	# Output: new density without the dimension; this density is unchanged
+	def integrate_lower_conv(self, axis, sigma):
+		obs = self.obs[axis]
+		below = obs[obs <= self.ROI[axis][0]]
+		edge = (below.max() if len(below) > 0 else obs[0] - self.step[axis]) + self.step[axis] / 2
+		w = ndtr( (edge - obs) / sigma )
+		density = Grid(np.tensordot(self.dens, w, axes=([axis], [0])), [ np.copy(o) for o in self.obs ], 
+			copy.deepcopy(self.ROI), copy.deepcopy(self.norm), self.age, self.Z)
+		density.correction = copy.deepcopy(self.correction)
+		density.remove_axis(axis)
+		return density
+
 	# marginalize in one of the dimensions; 
 	# overall density stays normalized if the dimension is not normalized over the ROI
 	def marginalize(self, axis):
@@ -0,0 +1,97 @@
+# Diagnostics of the model grids and of the observables at each age, as grouped reductions.
+# The summary of the observables at an age is small and is saved next to the observables, so that
+# the distances between isochrones and the maximum observable differences can be computed and plotted
+# without reading the observables again.
+import os, pickle, warnings
+import config as cf
+
+import numpy as np
+
+summary_name = 'diag.pkl'
+
+# Models with multi-valued initial masses at constant (age, EEP, omega0), in a set of MIST models
+# whose models are sorted lexicographically by the key variables
+# Output: list of (age, EEP, omega0, initial masses)
+def multivalued(st):
+	g = st.groups()
+	return [ (st.t[g[i]], st.EEP[g[i]], st.oM0[g[i]], st.Mini[g[i]:g[i+1]]) for i in np.nonzero(np.diff(g) > 1)[0] ]
+
+# maximum absolute observable differences in minimum standard deviations along an axis of an observable block;
+# NAN where all the differences are NAN
+def nanmax_diff(obs, axis, cf=cf):
+	diff = np.moveaxis(np.abs(np.diff(obs, axis=axis)) / cf.std, axis, 0)
+	n = diff.shape[0]
+	if diff.size == 0: return np.full(n, np.nan)
+	diff = diff.reshape(n, -1)
+	with warnings.catch_warnings(): # all-NAN slices happen at the edges of the grid
+		warnings.simplefilter('ignore')
+		return np.nanmax(diff, axis=1)
+
+# Summary of the observables at an age
+# Inputs:
+#	observables in blocks of the binary mass ratio dimension, in order, e.g. from obs_util.Obs.blocks();
+#		each item is a slice of mass ratios and observables
+#		with dimensions: initial mass, mass ratio, initial omega, inclination, observable
+#	EEPs of the models at r = 0; dimensions: initial mass, initial omega
+#	age
+#	model grids: initial mass, binary mass ratio, initial omega, inclination
+#	configuration
+# Output: dictionary with
+#	age and model grids
+#	maximum absolute observable differences in minimum standard deviations along each model dimension,
+#		in the order initial mass, mass ratio, initial omega, inclination
+#	integer EEPs, and the numbers and the sums of the observables of models with EEPs that round to them;
+#		the mass ratio and inclination dimensions are included, models with NAN magnitudes are not
+def summary(blocks, EEP, age, Mini, r, omega0, inc, cf=cf):
+	maxdiff = [None] * 4
+	# integer EEPs and their indices in the sums
+	e = np.around(EEP)
+	valid = ~np.isnan(e)
+	emin = int(e[valid].min()) if valid.any() else 0
+	key = np.where(valid, e - emin, -1).astype(int)
+	nb = int(key.max()) + 1 if valid.any() else 0
+	counts = np.zeros(nb)
+	sums = np.zeros((nb, 3))
+	prev = None # observables at the last mass ratio of the previous block
+	for rs, ob in blocks:
+		# differences along the dimensions other than mass ratio
+		for axis in [0, 2, 3]:
+			md = nanmax_diff(ob, axis, cf=cf)
+			maxdiff[axis] = md if maxdiff[axis] is None else np.fmax(maxdiff[axis], md)
+		# differences along the mass ratio dimension, including the one with the previous block
+		md = nanmax_diff(ob if prev is None else np.concatenate( (prev, ob), axis=1 ), 1, cf=cf)
+		maxdiff[1] = md if maxdiff[1] is None else np.concatenate( (maxdiff[1], md) )
+		prev = ob[:, -1:]
+		# sums of the observables at each EEP
+		k = np.broadcast_to(key[:, np.newaxis, :, np.newaxis], ob.shape[:-1])
+		m = (k >= 0) & ~np.isnan(ob[..., 0])
+		k = k[m]
+		counts += np.bincount(k, minlength=nb)
+		for i in range(3):
+			sums[:, i] += np.bincount(k, weights=ob[..., i][m], minlength=nb)
+	m = counts > 0
+	return {'age': age, 'Mini': Mini, 'r': r, 'omega0': omega0, 'inc': inc, 'maxdiff': maxdiff,
+		'EEP': np.nonzero(m)[0] + emin, 'counts': counts[m], 'sums': sums[m]}
+
+# Distance between the isochrones of two summaries, in minimum standard deviations of the observables:
+# differences between the mean observables of models at the same integer EEPs,
+# weighted by the numbers of models
+def isochrone_distance(s0, s1, cf=cf):
+	eep, i0, i1 = np.intersect1d(s0['EEP'], s1['EEP'], return_indices=True)
+	n0 = s0['counts'][i0]; n1 = s1['counts'][i1]
+	diff = s1['sums'][i1] / n1[:, np.newaxis] - s0['sums'][i0] / n0[:, np.newaxis]
+	numbers = n0 + n1
+	d = np.nansum(diff * numbers[:, np.newaxis], axis=0) / np.nansum(numbers)
+	return d / cf.std
+
+# file of the summary of the observables in a directory
+def summary_file(path):
+	return os.path.join(path, summary_name)
+
+def save(path, s):
+	with open(summary_file(path), 'wb') as f:
+		pickle.dump(s, f)
+
+def load(path):
+	with open(summary_file(path), 'rb') as f:
+		return pickle.load(f)
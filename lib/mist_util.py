@@ -1,4 +1,5 @@
-import sys, os, time, warnings
+import sys, os, time, warnings, heapq, copy
+from concurrent.futures import ThreadPoolExecutor
 sys.path.append(os.path.abspath(os.path.join('..', 'paint_atmospheres')))
 from pa.lib import surface as sf
 from pa.lib import util as ut
@@ -6,9 +7,10 @@ from pa.opt import grid as gd
 
 import load_data as ld
 import config as cf
+from lib import obs_util as ou
 
 import numpy as np
-from scipy.interpolate import griddata
+from scipy.spatial import Delaunay
 from matplotlib import pyplot as plt
 import matplotlib as mpl
 
@@ -27,47 +29,140 @@ def sizeof_fmt(num, suffix='B'):
 def combine_mags(mag1, mag2):
 	return -2.5 * np.log10( 10**(-mag1/2.5) + 10**(-mag2/2.5) )
 
-# a set of MIST models
+# observables of binary models: magnitude, color and vsini, computed in flux space
+# and written in blocks of the binary mass ratio dimension;
+# also computes the maximum absolute differences in the observables between adjacent mass ratios
+# Inputs:
+#	companion magnitudes; dimensions: initial primary mass, binary mass ratio, band
+#	primary magnitudes; dimensions: initial primary mass, initial omega, inclination, band
+#	primary vsini; dimensions: initial primary mass, initial omega, inclination
+#	number of mass ratios in a block
+#	whether to keep the observables; if not, only the differences are computed, one block at a time
+# Outputs:
+#	observables, as float32, None if not kept; dimensions: initial primary mass, binary mass ratio, initial omega, 
+#		inclination, magnitude / color / vsini; the models at the first mass ratio are unary
+#	maximum absolute differences between adjacent mass ratios; dimensions: mass ratio interval, observable;
+#		NAN where all the differences are NAN
+def binary_obs(mag_c, mag, vsini, nr=8, keep=True):
+	nM, nq = mag_c.shape[:2]
+	obs = np.empty( (nM, nq) + vsini.shape[1:] + (3,), dtype=np.float32 ) if keep else None
+	dm = np.full( (nq - 1, 3), np.nan )
+	prev = None # observables at the last mass ratio of the previous block
+	warnings.filterwarnings('ignore') # suppress the error for all-NAN slices
+	for k, ob in ou.binary_blocks(mag_c, mag, vsini, nr=nr):
+		if keep: obs[:, k:k + nr] = ob
+		# differences along the mass ratio dimension, including the one with the previous block
+		if prev is not None: ob = np.concatenate( (prev, ob), axis=1 )
+		diff = np.abs(np.diff(ob, axis=1))
+		dm[max(k - 1, 0) : k + nr - 1] = np.nanmax(diff, axis=(0, 2, 3))
+		prev = ob[:, -1:]
+	warnings.filterwarnings('default') # go back to default error reports
+	return obs, dm
+
+# a set of MIST models;
+# the models are rows of a (possibly memory-mapped) array that is shared between copies of the set,
+# the set itself holds the indices of its models in the array;
+# model parameter arrays are gathered from the array when they are first accessed;
+# the models of a set are sorted lexicographically by the key variables (metallicity, age, omega, EEP),
+# so that selections by these variables are slices found by binary search
 class Set:
+	# columns of the MIST grid file that are of interest:
+	# logZ oM0 EEP log10_isochrone_age_yr initial_mass star_mass log_L log_L_div_Ledd log_R surf_avg_omega_div_omega_crit
+	cols = [0, 1, 2, 3, 4, 5, 6, 7, 9, 13]
+	# key variables, in the order of sorting, and their columns among the variables of interest
+	keys = ['logZm', 't', 'oM0', 'EEP']
+	key_cols = [0, 3, 1, 2]
 
 	# load the MIST models
 	def __init__(self, filename=None, age=None, Z=None):
 		self.age = age
 		self.Z = Z
+		self.index = None # indices of the models in the data array; None for all models
+		self.vars = {} # model parameter arrays that have been gathered
 		if filename is not None:
 			# logZ oM0 EEP log10_isochrone_age_yr initial_mass star_mass log_L log_L_div_Ledd log_Teff\
 			# log_R surf_avg_omega surf_r_equatorial_div_r surf_r_polar_div_r surf_avg_omega_div_omega_crit
-			md = np.load(filename, allow_pickle=False)
-			# select only the variables of interest
-			self.models = md[:, [0, 1, 2, 3, 4, 5, 6, 7, 9, 13]]
-			self.set_vars()
+			self.data = np.load(filename, mmap_mode='r', allow_pickle=False)
+			self.cols = Set.cols
+			# the sorting order and the sorted key variables
+			index = Set.load_index(filename, self.data)
+			self.index = index[0].astype(int)
+			for j, x in zip(Set.key_cols, index[1:]):
+				self.vars[j] = x
 		else:
-			self.clear_vars()
+			self.data = np.empty((0, len(Set.cols)))
+			self.cols = list(range(len(Set.cols)))
 		self.omega0 = None
+		# age bracket tables for interpolation in age, keyed by the bracketing ages;
+		# shared between copies of the set with the same models
+		self.brackets = {}
+		self.clear_interp()
+
+	# load the index of a MIST grid file, building it if it doesn't exist or is older than the grid;
+	# the index is stored next to the grid file; its rows are the indices of the models
+	# that sort them by the key variables, followed by the sorted key variables
+	@staticmethod
+	def load_index(filename, data):
+		file = os.path.splitext(filename)[0] + '_index.npy'
+		if not os.path.exists(file) or os.path.getmtime(file) < os.path.getmtime(filename):
+			keys = [ np.array(data[:, Set.cols[j]]) for j in Set.key_cols ]
+			order = np.lexsort(keys[::-1])
+			index = np.stack( [order.astype(float)] + [x[order] for x in keys] )
+			tmp = file[:-4] + '.tmp' + str(os.getpid()) + '.npy'
+			np.save(tmp, index)
+			os.replace(tmp, file)
+		return np.load(file)
 
 	def copy(self):
-		st = Set()
-		st.models = np.copy(self.models)
-		st.age = self.age
-		st.Z = self.Z
-		st.set_vars()
+		st = Set(age=self.age, Z=self.Z)
+		st.data = self.data
+		st.cols = self.cols
+		st.index = self.index
+		st.vars = dict(self.vars)
+		st.brackets = self.brackets
+		st.tri = self.tri
+		st.bary = self.bary
 		if self.omega0 is not None:
 			st.omega0 = np.copy(self.omega0)
 		return st
 
-	# set model parameter arrays
-	def set_vars(self):	
-		self.logZm = self.models[:, 0] # logarithmic metallicity in MIST
-		self.oM0 = self.models[:, 1] # initial omega_MESA
-		self.EEP = self.models[:, 2] # eeps
-		self.t = self.models[:, 3] # log age in years
-		self.Mini = self.models[:, 4] # initial mass in solar masses
-		self.M = self.models[:, 5] # mass in solar masses
-		self.logL = self.models[:, 6] # log(luminosity) in solar luminosities
-		self.logL_div_Ledd = self.models[:, 7] # log of the Eddington ratio
-		self.R = 10**self.models[:, 8] # volume-averaged radius
-		self.oM = self.models[:, 9] # observed Omega / Omega_c
-		self.oMc = self.oM * np.sqrt(1 - 10**self.logL_div_Ledd) # Omega / Omega_c, corrected for luminosity
+	# gather a column of the array of models
+	def column(self, j):
+		if j not in self.vars:
+			if self.index is None: x = np.array(self.data[:, self.cols[j]])
+			else: x = self.data[self.index, self.cols[j]]
+			self.vars[j] = x
+		return self.vars[j]
+
+	# model parameter arrays
+	@property
+	def logZm(self): return self.column(0) # logarithmic metallicity in MIST
+	@property
+	def oM0(self): return self.column(1) # initial omega_MESA
+	@property
+	def EEP(self): return self.column(2) # eeps
+	@property
+	def t(self): return self.column(3) # log age in years
+	@property
+	def Mini(self): return self.column(4) # initial mass in solar masses
+	@property
+	def M(self): return self.column(5) # mass in solar masses
+	@property
+	def logL(self): return self.column(6) # log(luminosity) in solar luminosities
+	@property
+	def logL_div_Ledd(self): return self.column(7) # log of the Eddington ratio
+	@property
+	def R(self): return 10**self.column(8) # volume-averaged radius
+	@property
+	def oM(self): return self.column(9) # observed Omega / Omega_c
+	@property
+	def oMc(self): return self.oM * np.sqrt(1 - 10**self.logL_div_Ledd) # Omega / Omega_c, corrected for luminosity
+
+	# array of the models, with the variables of interest in columns
+	@property
+	def models(self):
+		if self.index is None: return np.array(self.data[:, self.cols])
+		else: return self.data[self.index][:, self.cols]
 
 	# set omega: ignore the correction due to the Eddington limit here; 
 	# it should be less than ~1% for an intermediate-age cluster
@@ -77,30 +172,100 @@ class Set:
 		omega0 = np.full_like(oM0, np.nan)
 		omega0[nn] = sf.omega(oM0[nn])
 		self.omega0 = omega0
-
-	# clear parameter arrays
-	def clear_vars(self):
-		self.logZm = np.empty((0,))
-		self.oM0 = np.empty((0,))
-		self.EEP = np.empty((0,))
-		self.t = np.empty((0,))
-		self.Mini = np.empty((0,))
-		self.M = np.empty((0,))
-		self.logL = np.empty((0,))
-		self.logL_div_Ledd = np.empty((0,))
-		self.R = np.empty((0,))
-		self.oM = np.empty((0,))
-		self.oMc = np.empty((0,))
-		self.omega0 = np.empty((0,))
-
-	# select a set of models
+		self.clear_interp()
+
+	# clear the triangulation of the models in (initial mass, omega) and the cached interpolation weights;
+	# these are shared between copies of the set with the same models
+	def clear_interp(self):
+		self.tri = None
+		self.bary = {} # for each initial omega: initial masses, simplex vertices, barycentric weights
+
+	# Delaunay triangulation of the models in (initial mass, omega), computed once for the models of the set
+	def triangulation(self):
+		if self.tri is None:
+			self.tri = Delaunay( np.stack((self.Mini, self.omega0), axis=-1) )
+		return self.tri
+
+	# vertices and barycentric weights for linear interpolation between the models of the set
+	# on a grid of initial mass and omega, as in griddata(..., method='linear');
+	# dimensions: initial mass, omega, vertex; weights are NAN outside the convex hull of the models;
+	# weights are cached for each omega value, so that only the new grid points are computed
+	def weights(self, Mi, o0):
+		tri = self.triangulation()
+		vert = np.zeros( (len(Mi), len(o0), tri.ndim + 1), dtype=int )
+		w = np.full( vert.shape, np.nan )
+		for k, o in enumerate(o0):
+			if o not in self.bary:
+				self.bary[o] = ( np.empty(0), np.zeros((0, tri.ndim + 1), dtype=int), np.empty((0, tri.ndim + 1)) )
+			x, v, b = self.bary[o]
+			new = np.setdiff1d(Mi, x)
+			if new.size > 0:
+				xi = np.stack( (new, np.full_like(new, o)), axis=-1 )
+				s = tri.find_simplex(xi)
+				T = tri.transform[s]
+				c = np.einsum('ijk,ik->ij', T[:, :tri.ndim], xi - T[:, tri.ndim])
+				c = np.concatenate( (c, 1 - c.sum(axis=1, keepdims=True)), axis=1 )
+				c[s == -1] = np.nan
+				# merge with the cached masses, keeping them sorted
+				x = np.concatenate( (x, new) )
+				i = np.argsort(x)
+				x = x[i]
+				v = np.concatenate( (v, tri.simplices[s]) )[i]
+				b = np.concatenate( (b, c) )[i]
+				self.bary[o] = (x, v, b)
+			i = np.searchsorted(x, Mi)
+			vert[:, k] = v[i]
+			w[:, k] = b[i]
+		return vert, w
+
+	# select a set of models by a boolean mask, a slice or an array of increasing indices into the set;
+	# this composes the selection with the current one
 	def select(self, mask):
-		self.models = self.models[mask, :]
+		if self.index is None: self.index = np.arange(self.data.shape[0])[mask]
+		else: self.index = self.index[mask]
 		if self.omega0 is not None:
 			self.omega0 = self.omega0[mask]
-		self.set_vars()
+		self.vars = {j: x[mask] for j, x in self.vars.items()}
+		self.brackets = {}
+		self.clear_interp()
+
+	# replace the models of the set with an array of models that have the variables of interest in columns
+	def set_models(self, models):
+		order = np.lexsort([models[:, j] for j in Set.key_cols[::-1]]) # sort by the key variables
+		self.data = models[order]
+		self.cols = list(range(len(Set.cols)))
+		self.index = None
+		self.vars = {}
+		self.brackets = {}
+		self.clear_interp()
+
+	# the range of models with a key variable between two values, as a slice,
+	# if the variable is sorted in the set, i.e. if the preceding key variables are constant;
+	# otherwise, None
+	def key_range(self, var, vmin, vmax):
+		k = Set.keys.index(var)
+		for j in Set.key_cols[:k]:
+			x = self.column(j)
+			if len(x) > 0 and x[0] != x[-1]: return None
+		x = self.column(Set.key_cols[k])
+		return slice(np.searchsorted(x, vmin, side='left'), np.searchsorted(x, vmax, side='right'))
+
+	# select models with a key variable between two values, inclusive
+	def select_range(self, var, vmin, vmax):
+		m = self.key_range(var, vmin, vmax)
+		if m is None: # the variable is not sorted in the set
+			x = getattr(self, var)
+			m = (x >= vmin) & (x <= vmax)
+		self.select(m)
+
+	# boundaries of the groups of models with the same values of the first n key variables;
+	# models in group i are those between boundaries i and i + 1
+	def groups(self, n=len(keys)):
+		x = [ self.column(j) for j in Set.key_cols[:n] ]
+		m = np.zeros(max(len(x[0]) - 1, 0), dtype=bool)
+		for y in x: m |= (y[1:] != y[:-1])
+		return np.concatenate( ([0], np.nonzero(m)[0] + 1, [len(x[0])]) )
 
-	# select models with valid rotation
 	def select_valid_rotation(self):
 		m = (self.oMc >= sf.omin) & (self.oMc <= sf.omax) # mask out models with negative or super-critical rotation
 		m = m & (self.oM0 < 0.8) # mask out models likely to be super-critical on the pre-main sequence
@@ -116,56 +281,94 @@ class Set:
 
 	def select_Z(self, Z):
 		self.Z = Z
-		if Z in self.logZm:		
-			m = (self.logZm == Z)
+		m = self.key_range('logZm', Z, Z)
+		if m.stop > m.start:
 			self.select(m)
 		# else: # interpolate in metallicity, possibly keeping age, EEP and omega0 constant			
 
 	def select_age(self, age):
 		self.age = age
-		if age in self.t:
-			m = (self.t == age)
+		m = self.key_range('t', age, age)
+		if m is None: m = np.nonzero(self.t == age)[0]
+		else: m = np.arange(m.start, m.stop)
+		if m.size > 0:
 			self.select(m)
 		else: # interpolate in age, keeping EEP and omega0 constant
-			EEP = np.unique(self.EEP)
-			oM0 = np.unique(self.oM0)
-			points = [ self.EEP, self.t ]
-			xi = [ EEP, [age] ]
-			if oM0.shape[0] > 1: # if omega is an interpolation variable
-				points.insert(1, self.oM0)
-				xi.insert(1, oM0)
-			xi = np.meshgrid( *xi, sparse=True, indexing='ij' )
-			models = griddata( tuple(points), self.models, tuple(xi), method='linear')
-			models = models.reshape(-1, models.shape[-1])
-			m = ~np.any(np.isnan(models), axis=-1)
-			self.models = models[m]
-			# correct for possible round-off error in initial omega_M
-			self.models[:, 1][ self.models[:, 1] < 0 ] = 0
-			# correct for possible round-off error in age
-			self.models[:, 3] = age
+			ages = np.unique(self.t)
+			i = np.searchsorted(ages, age)
+			if i == 0 or i == len(ages): # outside the age range
+				models = np.empty((0, len(Set.cols)))
+			else:
+				t0, t1 = ages[i - 1], ages[i]
+				i0, i1 = self.bracket(t0, t1)
+				# interpolate linearly along each track between the bracketing ages
+				w = (age - t0) / (t1 - t0)
+				models = self.rows(i0)
+				models += w * (self.rows(i1) - models)
+				# set age exactly; the other key variables are those of the tracks
+				models[:, 3] = age
 			# set variables
-			self.set_vars()
+			self.set_models(models)
 			# calculate initial omega
 			if self.omega0 is not None: self.set_omega0()
 
+	# the models of the set at given positions, with the variables of interest in columns
+	def rows(self, i):
+		if self.index is None: return np.array(self.data[i][:, self.cols])
+		else: return self.data[self.index[i]][:, self.cols]
+
+	# positions of the models at two ages that are on the same (metallicity, omega, EEP) tracks;
+	# the result is cached for the current selection
+	def bracket(self, t0, t1):
+		if (t0, t1) not in self.brackets:
+			i = [ np.nonzero(self.t == tv)[0] for tv in [t0, t1] ]
+			# sort the models at both ages by track, then by age,
+			# so that the models on a track present at both ages are adjacent
+			j = np.concatenate(i)
+			a = np.concatenate([np.zeros(len(i[0]), dtype=int), np.ones(len(i[1]), dtype=int)])
+			keys = [ self.column(k)[j] for k in Set.key_cols if k != 3 ]
+			o = np.lexsort([a] + keys[::-1])
+			j, a = j[o], a[o]
+			keys = [ x[o] for x in keys ]
+			# a model at the younger age, followed by one on the same track at the older age
+			m = (a[:-1] == 0) & (a[1:] == 1)
+			for x in keys: m &= (x[:-1] == x[1:])
+			k = np.nonzero(m)[0]
+			self.brackets[(t0, t1)] = (j[k], j[k + 1])
+		return self.brackets[(t0, t1)]
+
 # given a set of models and the boundaries of the observable space region where we need model priors,
-# calculate the lowest mass / highest magnitude cut-off
-def Mlim(st):
+# calculate the lowest mass / highest magnitude cut-off and the highest mass / lowest magnitude cut-off;
+# the lower cut-off is for the highest age of interest, the upper cut-off is for the lowest age
+# Inputs:
+#	set of models
+#	configuration, e.g. the config module
+#	catalog that determines the observable space region, e.g. the load_data module
+# Outputs:
+#	minimum mass, such that lower masses are fainter than the region even with equal-mass companions
+#	maximum mass, such that higher masses are brighter than the region even without companions 
+#		at any omega and inclination
+def Mlim(st, cf=cf, ld=ld):
 	# for any given mass, a star with the smallest magnitude is the one with the smallest omega
 	# (so that it has been moving towards TAMS fastest), largest age (so that it's closest to TAMS),
-	# smallest inclination (so that we see the star pole-on), and largest (i.e. equal-mass) companion.
+	# smallest inclination (so that we see the star pole-on), and largest (i.e. equal-mass) companion,
+	# which is non-rotating, as are all companions.
 	# construct the corresponding grid
 	Mi = np.array(np.linspace(st.Mini.min(), st.Mini.max(), 100)) 
 	omega0 = np.array([st.omega0.min()])  
 	inc = np.array([0]) 
-	grid = Grid(st, Mi, omega0, inc, cf.A_V)
+	grid = Grid(st, Mi, omega0, inc, cf.A_V, cf=cf)
+	# magnitudes of the non-rotating companions
+	stc = st.copy(); stc.select(stc.omega0 == 0)
+	Mc, magc = companion_table(stc, Grid.pars, cf.A_V, cf.modulus, cf=cf)
+	magc = np.interp(grid.Mini, Mc, magc[:, 1], left=np.nan, right=np.nan)
 	# combine primary and companion magnitudes 
-	mag = combine_mags(grid.obs[..., 0], np.expand_dims(grid.obs[:, 0, :, 0], 1))
+	mag = combine_mags(grid.obs[..., 0], magc[:, np.newaxis, np.newaxis])
 	# mask that is true where magnitude is below maximum
 	m = np.full_like(mag, False, dtype=bool) 
 	np.less_equal(mag, ld.obs1[np.newaxis, np.newaxis, 0], where=~np.isnan(mag), out=m)
 	# indices of masses above the lower mass cut-off
-	j = np.nonzero( np.any(m, axis=-1) )[0] 
+	j = np.nonzero( np.any(m, axis=(1, 2)) )[0] 
 	if len(j) > 0: # if there are masses above the cut-off
 		jmin = j.min();
 		# subtract one from the minimum mass index, if possible 
@@ -174,18 +377,48 @@ def Mlim(st):
 		Mmin = grid.Mini[jmin]
 	else:
 		Mmin = np.nan
-	return Mmin
+	# for any given mass, a star with the largest magnitude is a single star seen at some omega and inclination;
+	# construct a grid over these; a model between its nodes is brighter than the brightest node of its mass
+	# by at most the largest magnitude difference between neighboring nodes of the mass, 
+	# which is the margin, in addition to the maximum difference between neighboring models
+	omega0 = np.linspace(st.omega0.min(), st.omega0.max(), 5)
+	inc = np.linspace(0, np.pi/2, 5) 
+	grid = Grid(st, Mi, omega0, inc, cf.A_V, cf=cf)
+	mag = grid.obs[..., 0]
+	with warnings.catch_warnings(): # all-NAN slices at masses without models
+		warnings.simplefilter('ignore')
+		margin = np.fmax( np.nanmax(np.abs(np.diff(mag, axis=1)), axis=(1, 2)), \
+			np.nanmax(np.abs(np.diff(mag, axis=2)), axis=(1, 2)) )
+	margin[np.isnan(margin)] = 0
+	# mask that is true where magnitude is above minimum
+	m = np.full_like(mag, False, dtype=bool) 
+	np.greater_equal(mag, ld.obs0[0] - cf.dmax * cf.std[0] - margin[:, np.newaxis, np.newaxis], \
+		where=~np.isnan(mag), out=m)
+	# indices of masses below the upper mass cut-off
+	j = np.nonzero( np.any(m, axis=(1, 2)) )[0] 
+	if len(j) > 0: # if there are masses below the cut-off
+		# add one to the maximum mass index, if possible; models above the grid have no upper bound
+		jmax = j.max() + 1
+		Mmax = grid.Mini[jmax] if jmax < len(grid.Mini) else np.inf
+	else:
+		Mmax = np.nan
+	return Mmin, Mmax
 
 # given a set of models, produce a (M, omega, t, i) model grid with proper observable spacings at a given age;
 # if omega and inclination grids are given, refine only in mass dimension;
+# if a catalog is given, do not refine where models are outside its observable space region, 
+# and prune the grid at the edges of the refined dimensions;
 # this function sometimes gets stuck, in this case, restart
-def refine_coarsen(st, o0=None, inc=None):
+def refine_coarsen(st, o0=None, inc=None, cf=cf, ld=None):
 	# get maximum differences for all dimensions
 	def diffs(grid):
 		return np.array([np.nanmax(grid.get_maxdiff(i)) for i in range(grid.ndim)])
 	# get grid lengths for all dimensions
 	def lengths(grid):
 		return np.array([len(getattr(grid, grid.ivars[i])) for i in range(grid.ndim)])
+	# hash of the grid values in all dimensions
+	def nodes(grid):
+		return hash(tuple(getattr(grid, v).tobytes() for v in grid.ivars))
 
 	Mi = np.unique(st.Mini) # original mass grid
 	dims = list(range(Grid.ndim)) # dimensions to refine
@@ -194,23 +427,49 @@ def refine_coarsen(st, o0=None, inc=None):
 	if inc is None:	inc = np.linspace(0, np.pi/2, 2) # small inclination grid
 	else: dims.remove(2) # do not refine in inclination dimension
 
-	grid = Grid(st, Mi, o0, inc, cf.A_V)
+	box = None if ld is None else (ld.obs0, ld.obs1)
+	grid = Grid(st, Mi, o0, inc, cf.A_V, cf=cf, box=box)
+	grid.prune(0) # remove masses outside the region of interest
 	grid.coarsen(0, dmax=cf.dmax) # coarsen the mass grid, in case it's too fine to start with
 	md = diffs(grid) 	# get maximum differences for all dimensions
-	
-	while np.any(md[dims] > cf.dmax): # while any of the maximum differences are above the observable difference cutoff 
+
+	# refinement can get stuck, e.g. refining and coarsening a dimension in a cycle;
+	# stop after a number of refinements or when the grid repeats after coarsening, 
+	# and keep the grid with the smallest maximum difference so far
+	nit = 0 # number of refinements
+	seen = set() # dimensions and hashes of the grid values after coarsening
+	best = grid.copy(); best_md = np.max(md[dims]) # grid with the smallest maximum difference
+	grid.stalled = False
+	while np.any(md[dims] > cf.dmax) and not grid.stalled: # while any of the maximum differences are above the observable difference cutoff 
 		for i in dims: # for each of the dimensions (M, omega, i)
-			while (md[i] > cf.dmax): # while this dimension is not fine enough
+			while (md[i] > cf.dmax) and not grid.stalled: # while this dimension is not fine enough
 				ivar = grid.ivars[i]
 				var = getattr(grid, ivar) # get the grid in this dimension
 				if var.shape[0] > 1: # if the grid has more than one value
 					# print('Refining the ' + ivar + ' dimension.', flush=True)
-					while md[i] > cf.dmax: # while the maximum difference in this dimension is above the cutoff
+					while md[i] > cf.dmax and nit < cf.refine_iter: # while the maximum difference in this dimension is above the cutoff
 						grid.refine(i, dmin=cf.dmax) # refine this dimension
+						nit += 1
 						md = diffs(grid) # update maximum differences
+					if np.max(md[dims]) < best_md: best = grid.copy(); best_md = np.max(md[dims])
 					# print('Coarsening the ' + ivar + ' dimension.', flush=True)
 					grid.coarsen(i, dmax=cf.dmax)
 					md = diffs(grid)
+					if np.max(md[dims]) <= best_md: best = grid.copy(); best_md = np.max(md[dims])
+					state = (i, nodes(grid))
+					if nit >= cf.refine_iter:
+						print('refinement stopped after ' + str(nit) + ' iterations', flush=True)
+						grid.stalled = True
+					elif state in seen:
+						print('refinement stopped: the grid repeats after coarsening', flush=True)
+						grid.stalled = True
+					seen.add(state)
+			if grid.stalled: break
+	if grid.stalled: 
+		grid = best
+		grid.stalled = True
+	for i in dims: grid.prune(i) # remove the edges of the grid outside the region of interest
+	md = diffs(grid)
 	gl = lengths(grid)
 	print(md, flush=True)
 	print(gl, flush=True)
@@ -229,7 +488,11 @@ class Grid:
 	pars = None
 
 	def __init__(self, \
-			st=None, Mi=None, o0=None, inc=None, A_V=None, verbose=False):
+			st=None, Mi=None, o0=None, inc=None, A_V=None, verbose=False, cf=cf, box=None):
+		self.cf = cf # configuration, e.g. the config module
+		# lower and upper bounds of the observable space region where we need model priors, 
+		# e.g. (ld.obs0, ld.obs1); None for no bounds
+		self.box = box
 		# independent model parameters
 		self.Mini = Mi
 		self.omega0 = o0
@@ -238,6 +501,12 @@ class Grid:
 		self.st = st # set of MIST models
 		self.age = st.age
 		self.Z = st.Z
+		# initial masses and magnitudes of non-rotating companions, which bound the magnitudes of binaries
+		# in outside(); only needed with bounds
+		self.companions = None
+		if box is not None and st is not None:
+			stc = st.copy(); stc.select(stc.omega0 == 0)
+			self.companions = companion_table(stc, self.pars, A_V, cf.modulus, cf=cf)
 		# interpolate to set the dependent parameters
 		if st is not None:
 			self.calc_obs(verbose=verbose)
@@ -245,6 +514,8 @@ class Grid:
 			self.mag = None
 			self.vsini = None
 			self.obs = None
+			self.sides = None
+			self.maxdiff = [None] * self.ndim
 
 	# clear the dependent model variables that are used for calculations
 	def clear_vars(self):
@@ -253,11 +524,18 @@ class Grid:
 		del self.omega
 		del self.Req
 
+	# copy of the grid that shares its arrays, the MIST models and the configuration;
+	# refinement and coarsening replace the arrays of a grid rather than modify them
+	def copy(self):
+		grid = copy.copy(self)
+		grid.maxdiff = list(self.maxdiff)
+		return grid
+
 	# return a version of the object for pickling;
 	# this copy only has the independent star model variables, the observables, and the cluster variables;
 	# it does not have the original MIST models or the PARS grid.
 	def pickle(self):
-		grid = Grid(Mi=self.Mini, o0=self.omega0, inc=self.inc, A_V=self.A_V)
+		grid = Grid(Mi=self.Mini, o0=self.omega0, inc=self.inc, A_V=self.A_V, cf=self.cf)
 		grid.mag = np.copy(self.mag).astype(np.float32)
 		grid.vsini = np.copy(self.vsini).astype(np.float32)
 		grid.age = self.age
@@ -276,32 +554,31 @@ class Grid:
 	# Note: when you are certain you don't need to interpolate in age here, remove
 	# 	all comments that used to be program code and have the 'age' boolean variable in them
 	def interp(self):
-		st = self.st
-		points = [ st.Mini, st.omega0 ] # points from which to interpolate
-		xi = [ self.Mini, self.omega0 ] # points at which to interpolate
-		dims = [ 0, 1 ] # corresponding dimensions
-		xi = np.meshgrid( *xi, sparse=True, indexing='ij' )
-		
-		## calculate the dependent variables via interpolation in the independent variables; 
-		## use the linear method because there are small discontinuities at a limited range of masses
-		M = griddata( tuple(points), st.M, tuple(xi), method='linear' ) # mass
+		dims = [ 0, 1 ] # dimensions of the independent variables in which we interpolate
+		dvars = self.interp_vars(self.Mini, self.omega0)
 		# remove intermediate grid points where all masses are NaN
 		for i in dims:
 			# mask that shows at which grid points not all entries are NaN 
-			m = ~np.all(np.isnan(M), axis=tuple(np.delete(dims, i)))
+			m = ~np.all(np.isnan(dvars[0]), axis=tuple(np.delete(dims, i)))
 			m[0] = m[-1] = True # keep the original boundary grid points
 			var = getattr(self, self.ivars[i]) # get this parameter grid (e.g. Mini, omega0)
 			setattr(self, self.ivars[i], var[m]) # delete the NaN grid points
-			M = np.compress(m, M, axis=i) # delete the NaN grid points from the mass array
-		self.M = M
-		# re-calculate the points at which we interpolate
-		xi = [ self.Mini, self.omega0 ]
-		xi = np.meshgrid( *xi, sparse=True, indexing='ij' )
-		# calculate the rest of the dependent variables
-		self.L = 10**griddata( tuple(points), st.logL, tuple(xi), method='linear' )
-		oM = griddata( tuple(points), st.oM, tuple(xi), method='linear' )
-		logL_div_Ledd = griddata( tuple(points), st.logL_div_Ledd, tuple(xi), method='linear' )
-		R = griddata( tuple(points), st.R, tuple(xi), method='linear' )
+			dvars = [ np.compress(m, x, axis=i) for x in dvars ] # delete the NaN grid points from the variables
+		self.M, self.L, self.omega, self.Req = dvars
+
+	# Interpolates the dependent model variables on a grid of initial mass and omega;
+	# returns mass, luminosity, PARS' omega and equatorial radius
+	def interp_vars(self, Mi, o0):
+		st = self.st
+		# vertices and weights for interpolation between the models of the set, cached by the set
+		v, w = st.weights(Mi, o0)
+		## calculate the dependent variables via interpolation in the independent variables; 
+		## use the linear method because there are small discontinuities at a limited range of masses
+		M = np.sum(st.M[v] * w, axis=-1) # mass
+		L = 10**np.sum(st.logL[v] * w, axis=-1)
+		oM = np.sum(st.oM[v] * w, axis=-1)
+		logL_div_Ledd = np.sum(st.logL_div_Ledd[v] * w, axis=-1)
+		R = np.sum(st.R[v] * w, axis=-1)
 		oMc = oM * np.sqrt(1 - 10**logL_div_Ledd)
 		# mitigate round-off error from interpolation
 		notnan = ~np.isnan(oMc)
@@ -318,8 +595,7 @@ class Grid:
 		Req[nnf] = R.flatten()[nnf] * np.cbrt((4 * np.pi / 3) / sf.V(omega[nnf]))
 		omega = omega.reshape(sh)
 		Req = Req.reshape(sh)
-		self.omega = omega
-		self.Req = Req
+		return [M, L, omega, Req]
 
 	def calc_obs(self, verbose=False):
 		if verbose:
@@ -328,6 +604,17 @@ class Grid:
 				'{:,}'.format(len(self.Mini) * len(self.omega0) * len(self.inc)) + ' models...')
 			start = time.time()
 		self.interp() # calculate the dependent model variables
+		self.mag, self.vsini = self.calc_mag(self.M, self.L, self.omega, self.Req, self.inc)
+		self.obs = self.observables(self.mag, self.vsini)
+		self.sides = self.outside(self.obs, self.Mini)
+		# maximum differences along each dimension, computed when needed
+		self.maxdiff = [None] * self.ndim
+		if verbose:
+			print('\t' + str(time.time() - start) + ' seconds.')
+
+	# Computes the magnitudes and vsini from the dependent model variables 
+	# on a grid of initial mass and omega and a set of inclinations
+	def calc_mag(self, M, L, omega, Req, inc):
 		# construct points for interpolating from the PARS grid;
 		# 	each point is a set of values used by the PARS grid in which we interpolate
 		#	(e.g. [tau, omega, inclination, gamma] 
@@ -336,41 +623,70 @@ class Grid:
 		# 	(e.g. initial mass, initial omega),
 		#	plus additional parameters for PARS that MESA models don't have 
 		#	(e.g. inclination)
-		tau = ut.tau(self.L, self.Req) # has dimensions of the grid of MESA independent variables
-		gamma = ut.gamma(self.M, self.Req) # has dimensions of the grid of MESA independent variables
-		pars_dims = len(self.pars.dims) - 3 # number of interpolated PARS dimensions
-		# start with arrays of PARS interpolated variables on a grid of 
-		# MESA independent variables and inclination
-		points = np.full(self.M.shape + ( len(self.inc), pars_dims ), np.nan)
-		points[..., 0] = tau[..., np.newaxis] # add axes for non-MESA independent variables
-		points[..., 1] = self.omega[..., np.newaxis] # add axes for non-MESA independent variables
-		points[..., 2] = self.inc # if this is the only MESA-independent variable, no new axes necessary here
-		points[..., 3] = gamma[..., np.newaxis] # add axes for non-MESA independent variables
-		# points[..., 4] = ut.logZp_from_logZm(self.st.Z) # same metallicity for each point
-		# points[..., 5] = self.A_V # same AV for each point
-		# record the shape of the grid and flatten it, keeping the arrays of PARS variables intact
-		sh = points.shape[:-1] 
-		points = points.reshape( (-1, pars_dims) )
+		tau = ut.tau(L, Req) # has dimensions of the grid of MESA independent variables
+		gamma = ut.gamma(M, Req) # has dimensions of the grid of MESA independent variables
 		# interpolate from the PARS grid;
-		# the result is an an array of magnitudes, e.g. [F435W, F555W, F814W]
-		mag = gd.interp4d(self.pars, points, ut.logZp_from_logZm(self.st.Z), self.A_V)
-		# reshape magnitudes back to the grid of evolutionary model parameters
-		mag = mag.reshape(sh + (len(self.pars.bands), ))
+		# the result is an an array of magnitudes, e.g. [F435W, F555W, F814W], 
+		# on the grid of evolutionary model parameters and inclination
+		mag = interp_pars(self.pars, tau, omega, gamma, inc, ut.logZp_from_logZm(self.st.Z), self.A_V, cf=self.cf)
 		# correct for radius and distance;
 		# the radius array needs extra dimensions due to bands and PARS parameters
 		# that evolutionary models don't have (e.g. inclination)
-		self.mag = gd.correct(mag, self.Req[..., np.newaxis, np.newaxis], cf.modulus)
-		self.vsini = ut.vsini1(self.M[..., np.newaxis], self.Req[..., np.newaxis], \
-			self.omega[..., np.newaxis], self.inc[np.newaxis, np.newaxis, :]) / 1e5
-		self.obs = np.stack( (self.mag[..., 1], self.mag[..., 0] - self.mag[..., 2], self.vsini), axis=-1 )
-		self.clear_vars() # clear the dependent model variables
-		if verbose:
-			print('\t' + str(time.time() - start) + ' seconds.')
-
-	# Get the maximum (observable difference / std) in a focal model dimension 
-	def get_maxdiff(self, axis):
-		# absolute difference in sigmas along the axis
-		diff = np.abs(np.diff(self.obs, axis=axis)) / cf.std
+		mag = gd.correct(mag, Req[..., np.newaxis, np.newaxis], self.cf.modulus)
+		vsini = ut.vsini1(M[..., np.newaxis], Req[..., np.newaxis], \
+			omega[..., np.newaxis], inc[np.newaxis, np.newaxis, :]) / 1e5
+		return mag, vsini
+
+	# observables from magnitudes and vsini: magnitude, color, vsini
+	@staticmethod
+	def observables(mag, vsini):
+		return np.stack( (mag[..., 1], mag[..., 0] - mag[..., 2], vsini), axis=-1 )
+
+	# sides of the observable space region of interest beyond which the models lie, as bits:
+	# 1 if too faint even with an equal-mass companion, 2 if too bright even without a companion,
+	# 4 if vsini is too large, 8 if vsini is too small; all bits for models with NAN observables;
+	# the region is extended by the maximum difference between neighboring models;
+	# the magnitude with an equal-mass companion combines that of the model with the magnitude 
+	# of a non-rotating star of the same initial mass, or is 2.5 log10(2) brighter if there is no such star
+	# Inputs: observables of models, initial masses of the models along the first dimension
+	def outside(self, obs, Mini):
+		sides = np.zeros(obs.shape[:-1], dtype=np.uint8)
+		if self.box is None: return sides
+		lo = self.box[0] - self.cf.dmax * self.cf.std
+		hi = self.box[1] + self.cf.dmax * self.cf.std
+		mag = obs[..., 0]
+		vsini = obs[..., 2]
+		nn = ~np.isnan(mag) & ~np.isnan(vsini)
+		mag_b = mag - 2.5 * np.log10(2) # brightest binary magnitude
+		if self.companions is not None:
+			Mc, magc = self.companions
+			magc = np.interp(Mini, Mc, magc[:, 1], left=np.nan, right=np.nan)
+			magc = np.broadcast_to(magc.reshape((-1,) + (1,) * (mag.ndim - 1)), mag.shape)
+			m = nn & ~np.isnan(magc)
+			mag_b[m] = combine_mags(mag[m], magc[m])
+		sides[nn & (mag_b > hi[0])] |= 1
+		sides[nn & (mag < lo[0])] |= 2
+		sides[nn & (vsini > hi[2])] |= 4
+		sides[nn & (vsini < lo[2])] |= 8
+		sides[~nn] = 15
+		return sides
+
+	# whether the models at the boundaries of intervals, and at other given grid points, 
+	# are outside the region of interest on a common side; 
+	# intervals where this is so are ignored in refinement and coarsening
+	@staticmethod
+	def out(*sides):
+		s = sides[0]
+		for x in sides[1:]: s = s & x
+		return s != 0
+
+	# Maximum (observable difference / std) along an axis of an array of observables,
+	# across observables and the other model dimensions;
+	# differences where a mask is true are ignored
+	def nanmax_diff(self, diff, axis, mask=None):
+		# absolute difference in sigmas
+		diff = np.abs(diff) / self.cf.std
+		if mask is not None: diff[mask] = np.nan
 		# move the focal model axis to the front		
 		diff = np.moveaxis(diff, axis, 0)
 		if diff.shape[0] > 0: # if the focal axis has more than one element
@@ -386,6 +702,23 @@ class Grid:
 			maxdiff = np.array([0])
 		return maxdiff
 
+	# Maximum (observable difference / std) of intervals in a model dimension, across observables
+	# and the other model dimensions, given the observables and the sides of the models at the ends of the intervals,
+	# with the focal dimension first; differences between the models at the ends of an interval are ignored 
+	# where both are outside the region of interest on a common side;
+	# refinement and coarsening compute the maximum differences of all intervals here
+	def interval_maxdiff(self, obs0, obs1, sides0, sides1):
+		return self.nanmax_diff(obs1 - obs0, 0, self.out(sides0, sides1))
+
+	# Get the maximum (observable difference / std) in a focal model dimension;
+	# this is kept up to date by refinement and coarsening in the focal dimension 
+	def get_maxdiff(self, axis):
+		if self.maxdiff[axis] is None:
+			obs = np.moveaxis(self.obs, axis, 0)
+			sides = np.moveaxis(self.sides, axis, 0)
+			self.maxdiff[axis] = self.interval_maxdiff(obs[:-1], obs[1:], sides[:-1], sides[1:])
+		return self.maxdiff[axis]
+
 	# Subdivide each interval into n subintervals, where n is the ceiling of the largest 
 	# 	(observable difference / (std * dmin)), where dmin is a class variable
 	# Inputs:
@@ -399,117 +732,177 @@ class Grid:
 		notnan = ~np.isnan(maxdiff)
 		ns = np.ones_like(maxdiff, dtype=int) 
 		ns[notnan] = np.ceil(maxdiff[notnan] / dmin).astype(int)
-		# split intervals: reverse so that indices remain valid
-		for i in np.flip(np.where(ns > 1.)[0]): 
-			# split the interval at each location and insert the result 
-			var = np.insert(var, i+1, np.linspace(var[i], var[i+1], ns[i]+1)[1:-1])
-		setattr(self, self.ivars[axis], var) # set the model parameter list
-		self.calc_obs() # calculate the observables
-
-	# Coarsen the model grid in a given focal dimension 
+		# values that split the intervals
+		new = [ np.linspace(var[i], var[i+1], ns[i]+1)[1:-1] for i in np.where(ns > 1.)[0] ]
+		if len(new) > 0:
+			self.insert(axis, np.concatenate(new)) # calculate the observables at the new values
+
+	# Insert new values of a model parameter into the grid, computing the observables only at these values
+	# Inputs:
+	#	model dimension
+	#	new values of the model parameter, not on the grid
+	def insert(self, axis, new):
+		ivar = self.ivars[axis]
+		if axis < 2: # a MIST interpolation variable
+			grids = [ self.Mini, self.omega0 ]
+			grids[axis] = new
+			dvars = self.interp_vars(*grids)
+			# remove the new grid points where all masses are NaN
+			m = ~np.all(np.isnan(dvars[0]), axis=1 - axis)
+			new = new[m]
+			dvars = [ np.compress(m, x, axis=axis) for x in dvars ]
+			if new.size == 0: return
+			mag, vsini = self.calc_mag(*dvars, self.inc)
+		else: # inclination
+			mag, vsini = self.calc_mag(self.M, self.L, self.omega, self.Req, new)
+		obs = self.observables(mag, vsini)
+		sides = self.outside(obs, new if axis == 0 else self.Mini)
+		# maximum differences in the other dimensions can only increase due to the new slices
+		for i in range(self.ndim):
+			if i != axis and self.maxdiff[i] is not None:
+				o = np.moveaxis(obs, i, 0)
+				s = np.moveaxis(sides, i, 0)
+				self.maxdiff[i] = np.fmax(self.maxdiff[i], self.interval_maxdiff(o[:-1], o[1:], s[:-1], s[1:]))
+		# merge the new slices with the old ones, in the order of the model parameter
+		var = getattr(self, ivar)
+		n = len(var)
+		var = np.concatenate( (var, new) )
+		order = np.argsort(var, kind='stable')
+		setattr(self, ivar, var[order])
+		self.mag = np.take(np.concatenate( (self.mag, mag), axis=axis ), order, axis=axis)
+		self.vsini = np.take(np.concatenate( (self.vsini, vsini), axis=axis ), order, axis=axis)
+		self.obs = np.take(np.concatenate( (self.obs, obs), axis=axis ), order, axis=axis)
+		self.sides = np.take(np.concatenate( (self.sides, sides), axis=axis ), order, axis=axis)
+		if axis < 2:
+			self.M, self.L, self.omega, self.Req = [ np.take(np.concatenate( (x, y), axis=axis ), order, axis=axis) \
+				for x, y in zip([self.M, self.L, self.omega, self.Req], dvars) ]
+		# maximum differences in the focal dimension only change in the intervals that have new endpoints
+		if self.maxdiff[axis] is not None:
+			isnew = (order >= n)
+			ch = isnew[:-1] | isnew[1:] # intervals with new endpoints
+			k = np.cumsum(~isnew)[:-1] - 1 # for intervals with old endpoints, index of the interval on the old grid
+			maxdiff = np.full(len(order) - 1, np.nan)
+			maxdiff[~ch] = self.maxdiff[axis][k[~ch]]
+			i = np.nonzero(ch)[0]
+			obs = np.moveaxis(self.obs, axis, 0)
+			sides = np.moveaxis(self.sides, axis, 0)
+			maxdiff[ch] = self.interval_maxdiff(obs[i], obs[i + 1], sides[i], sides[i + 1])
+			self.maxdiff[axis] = maxdiff
+
+	# Coarsen the model grid in a given focal dimension;
+	# repeatedly take the interval with the smallest maximum difference that can be merged
+	# with a neighbor so that the combined difference is at most dmax, and merge it with the neighbor
+	# for which the combined difference is smaller;
+	# candidate intervals are kept in a priority queue and the grid points in a linked list,
+	# the arrays are compacted once at the end
 	def coarsen(self, axis, dmax=1.0):
-		obs = self.obs
-		mag = self.mag
-		vsini = self.vsini		
-		# move the focal model axis to the front
-		obs = np.moveaxis(obs, axis, 0) 
-		mag = np.moveaxis(mag, axis, 0)
-		vsini = np.moveaxis(vsini, axis, 0) 
 		# model parameter grid 
 		var = getattr(self, self.ivars[axis])
-		maxdiff = self.get_maxdiff(axis)
-		ind = np.argsort(maxdiff) # indices of sorted differences, NAN are at the end
-		i = 0 # index in the above array of indices
-		j = ind[i] # current index in the array of maximum differences
-		stop = False
-		# check for the stopping condition
-		if np.isnan(maxdiff[j]): stop = True
-		elif maxdiff[j] >= dmax: stop = True
-		while not stop:
+		n = len(var)
+		if n < 3: return # no interval has a neighbor
+		# move the focal model axis to the front
+		obs = np.moveaxis(self.obs, axis, 0) 
+		sides = np.moveaxis(self.sides, axis, 0)
+		# maximum differences of intervals, indexed by their left grid points
+		maxdiff = np.append(self.get_maxdiff(axis), np.nan)
+		# linked list of remaining grid points
+		keep = np.ones(n, dtype=bool)
+		prev = np.arange(n) - 1
+		nxt = np.arange(n) + 1
+		# queue of candidate intervals; entries are invalidated by incrementing an interval's version
+		version = np.zeros(n, dtype=int)
+		heap = []
+		def push(j):
+			if j >= 0 and keep[j]:
+				version[j] += 1
+				if maxdiff[j] < dmax: 
+					heapq.heappush( heap, (maxdiff[j], j, version[j]) )
+		# maximum difference between two grid points, when the grid point in between is removed,
+		# as get_maxdiff() computes it for the merged interval; NAN if it is above the maximum allowable difference,
+		# or if the grid point in between is not outside the region of interest on a side
+		# where the differences of the merged interval are ignored
+		def merged(j0, j1, i):
+			if np.any( self.out(sides[j0], sides[j1]) & ~self.out(sides[j0], sides[i], sides[j1]) ): return np.nan
+			d = self.interval_maxdiff(obs[[j0]], obs[[j1]], sides[[j0]], sides[[j1]])[0]
+			if d > dmax: d = np.nan
+			return d
+		for j in range(n - 1): push(j)
+		while heap:
+			d, j, v = heapq.heappop(heap)
+			if v != version[j] or not keep[j]: continue # the entry is stale
+			k = nxt[j] # right bound of the focal interval
 			# differences due to the merging of the focal interval with neighbors to the left or right
-			maxright = np.nan
-			maxleft = np.nan
-			# if there is an interval to the right of the focal interval
-			if j < len(maxdiff) - 1: 
-				# subtract the observables at the lower bound of the corresponding interval
-				# from those at the upper bound of the interval to the right; compute the maximum
-				warnings.filterwarnings('ignore') # suppress the error for all-NAN slices
-				maxright = np.nanmax( np.abs(obs[j+2,...] - obs[j,...]) / cf.std )
-				warnings.filterwarnings('default') # go back to default error reports
-				# only consider the merge if the combined differences are below the maximum allowable difference
-				if maxright > dmax: maxright = np.nan
-			# if there is an interval to the left of the focal interval
-			if j > 0:
-				# get maximum differences due to the merging of the focal interval with the interval to the left
-				warnings.filterwarnings('ignore') # suppress the error for all-NAN slices
-				maxleft = np.nanmax( np.abs(obs[j+1,...] - obs[j-1,...]) / cf.std )
-				warnings.filterwarnings('default') # go back to default error reports
-				if maxleft > dmax: maxleft = np.nan
+			maxright = merged(j, nxt[k], k) if nxt[k] < n else np.nan
+			maxleft = merged(prev[j], k, j) if prev[j] >= 0 else np.nan
 			# determine whether to merge with the left neighbor, the right neighbor or not at all
 			if ~np.isnan(maxleft):
 				if ~np.isnan(maxright):
-					if maxleft <= maxright:
-						merge = 'left'
-					else:
-						merge = 'right'
+					merge = 'left' if maxleft <= maxright else 'right'
 				else:
 					merge = 'left'
 			elif ~np.isnan(maxright):
 				merge = 'right'
 			else:
 				merge = None
-			# if not merging, advance the index of indices
-			if merge is None:
-				i += 1
-				if i < len(ind):
-					j = ind[i]
-				else:
-					stop = True
-			elif merge == 'left':
-				## merge with the interval to the left: 
-				# delete the left bound from the observables arrays, 
-				obs = np.delete(obs, j, axis=0)
-				mag = np.delete(mag, j, axis=0)
-				vsini = np.delete(vsini, j, axis=0)
-				# replace the maximum differences for the focal interval and the left neighbor 
-				# with the combined maximum differences 
-				maxdiff[j-1] = maxleft
-				maxdiff = np.delete(maxdiff, j)
-				# delete the model variable value at the left boundary of the focal interval
-				var = np.delete(var, j)
-			elif merge == 'right':
-				## merge with the interval to the right: 
-				# delete the right bound from the observables arrays, 
-				obs = np.delete(obs, j+1, axis=0)
-				mag = np.delete(mag, j+1, axis=0)
-				vsini = np.delete(vsini, j+1, axis=0)
-				# replace the maximum differences for the focal interval and the right neighbor 
-				# with the combined maximum differences 
+			if merge is None: continue # the interval stays out of the queue until its neighbors change
+			if merge == 'left':
+				# delete the left bound of the focal interval; the left neighbor becomes the merged interval
+				i = j
+				j = prev[j]
+				maxdiff[j] = maxleft
+			else:
+				# delete the right bound of the focal interval
+				i = k
 				maxdiff[j] = maxright
-				maxdiff = np.delete(maxdiff, j+1)
-				# delete the model variable value at the right boundary of the focal interval
-				var = np.delete(var, j+1)
-			if merge is not None:
-				# re-set the sorted maximum differences
-				ind = np.argsort(maxdiff)
-				i = 0 
-				j = ind[i]
-			# check for the stopping condition
-			if np.isnan(maxdiff[j]): stop = True
-			elif maxdiff[j] >= dmax: stop = True
-		# move the focal model axis back into its place
-		self.obs = np.moveaxis(obs, 0, axis) 
-		self.mag = np.moveaxis(mag, 0, axis)
-		self.vsini = np.moveaxis(vsini, 0, axis)
-		setattr(self, self.ivars[axis], var) # set the model parameter list
+			keep[i] = False
+			nxt[prev[i]] = nxt[i]
+			prev[nxt[i]] = prev[i]
+			# re-queue the merged interval and its neighbors, whose merge options have changed
+			for jj in [prev[j], j, nxt[j]]:
+				if jj < n - 1: push(jj)
+		# compact the arrays
+		if not np.all(keep):
+			self.compress(axis, keep)
+		self.maxdiff[axis] = maxdiff[keep][:-1]
+
+	# keep the grid points in a dimension where a mask is true
+	def compress(self, axis, keep):
+		self.obs = np.compress(keep, self.obs, axis=axis) 
+		self.mag = np.compress(keep, self.mag, axis=axis)
+		self.vsini = np.compress(keep, self.vsini, axis=axis)
+		self.sides = np.compress(keep, self.sides, axis=axis)
+		ivar = self.ivars[axis]
+		setattr(self, ivar, getattr(self, ivar)[keep]) # set the model parameter list
+		# delete the grid points from the dependent model variables
+		if axis < 2:
+			self.M, self.L, self.omega, self.Req = \
+				[ np.compress(keep, x, axis=axis) for x in [self.M, self.L, self.omega, self.Req] ]
+		# the maximum differences in the other dimensions may have decreased
+		self.maxdiff = [ None ] * self.ndim
+
+	# remove the grid points at either end of a dimension, 
+	# while the intervals they bound are outside the region of interest; keep at least two grid points
+	def prune(self, axis):
+		n = self.sides.shape[axis]
+		if self.box is None or n < 3: return
+		s = np.moveaxis(self.sides, axis, 0)
+		out = np.all( self.out(s[:-1], s[1:]).reshape(n - 1, -1), axis=1 )
+		lo = 0
+		while lo < n - 2 and out[lo]: lo += 1
+		hi = n - 1
+		while hi > lo + 1 and out[hi - 1]: hi -= 1
+		if lo > 0 or hi < n - 1:
+			keep = np.zeros(n, dtype=bool)
+			keep[lo:hi + 1] = True
+			maxdiff = self.get_maxdiff(axis)[lo:hi]
+			self.compress(axis, keep)
+			self.maxdiff[axis] = maxdiff
 
 	# get EEP on the model grid		
 	def get_EEP(self):
 		st = self.st
-		points = [ st.Mini, st.omega0 ] # points from which to interpolate
-		xi = [ self.Mini, self.omega0 ] # points at which to interpolate
-		xi = np.meshgrid( *xi, sparse=True, indexing='ij' )
-		EEP = griddata( tuple(points), st.EEP, tuple(xi), method='linear')
+		v, w = st.weights(self.Mini, self.omega0)
+		EEP = np.sum(st.EEP[v] * w, axis=-1)
 		return EEP
 
 	def plot_diff(self, axis, filename):
@@ -526,51 +919,101 @@ class Grid:
 		plt.savefig(filename, dpi=200)
 		plt.close()
 
+# tables of non-rotating companion magnitudes, keyed by age, metallicity, reddening, distance modulus,
+# PARS grid, the number of masses in a table and the initial masses of the models, 
+# since sets at the same age may have different mass ranges
+companion_tables = {}
+
+# magnitudes of non-rotating stars on a dense grid of initial mass, 
+# at the age and metallicity of a set of non-rotating models;
+# the grid includes the masses of the models; the tables are cached in companion_tables
+# Inputs:
+#	set of non-rotating models at a single age
+# 	PARS grid of observables
+#	reddening
+#	distance modulus
+#	configuration, e.g. the config module
+# Outputs:
+#	initial masses, in increasing order
+#	magnitudes; dimensions: initial mass, band
+def companion_table(st, pars, A_V, modulus, cf=cf):
+	# models in the order of initial mass
+	Mini, i = np.unique(st.Mini, return_index=True)
+	key = (st.age, st.Z, A_V, modulus, id(pars), cf.companion_nm, Mini.tobytes())
+	if key not in companion_tables:
+		Mi = np.union1d( Mini, np.linspace(Mini[0], Mini[-1], cf.companion_nm) )
+		# MIST model dependent variables
+		M = np.interp(Mi, Mini, st.M[i])
+		L = 10**np.interp(Mi, Mini, st.logL[i])
+		R = np.interp(Mi, Mini, st.R[i])
+		# PARS grid variables
+		tau = ut.tau(L, R) 
+		gamma = ut.gamma(M, R) 
+		# interpolate from the PARS grid, with omega zero and inclination zero;
+		# the result is an an array of magnitudes, e.g. [F435W, F555W, F814W]
+		mag = interp_pars(pars, tau, np.zeros_like(tau), gamma, np.zeros(1), ut.logZp_from_logZm(st.Z), A_V, cf=cf)
+		mag = mag[:, 0, :] # remove the inclination dimension
+		# correct for radius and distance;
+		# the radius array needs extra dimensions due to bands
+		mag = gd.correct(mag, R[..., np.newaxis], modulus)
+		companion_tables[key] = (Mi, mag)
+	return companion_tables[key]
+
 # companion magnitudes on a grid of initial mass of the primary and binary mass ratio
 # Inputs:
 #	mass ratio grid
 #	primary mass grid
-#	set of models
-# 	single age
+#	set of non-rotating models at a single age
 # 	PARS grid of observables
 #	reddening
 #	distance modulus
-# Note: when you are certain you don't need to interpolate in age here, remove the 
-#	comments that have the age boolean in them, which used to be program code
-def companion_grid(r, Mini, st, pars, A_V, modulus):
+#	configuration, e.g. the config module
+# Output: magnitudes; dimensions: initial primary mass, binary mass ratio, band
+def companion_grid(r, Mini, st, pars, A_V, modulus, cf=cf):
 	Mc = Mini[:, np.newaxis] * r[np.newaxis, :] # companion mass on a grid of primary mass and binary ratio
-	points = ( st.Mini, ) # points from which to interpolate
-	xi = Mc # points at which to interpolate
-
-	## compute all three magnitudes of non-rotating companions 
+	# magnitudes on a dense grid of companion mass
+	Mi, mag = companion_table(st, pars, A_V, modulus, cf=cf)
+	## look up all three magnitudes of non-rotating companions 
 	## on a grid of primary initial mass and binary mass ratio;
 	## about half of the values won't exist because companion mass doesn't go low enough in the model grids
-	# MIST model dependent variables
-	M = griddata( points, st.M, xi, method='linear' )
-	L = 10**griddata( points, st.logL, xi, method='linear' )
-	logL_div_Ledd = griddata( points, st.logL_div_Ledd, xi, method='linear' )
-	R = griddata( points, st.R, xi, method='linear' )
-	# PARS grid variables
-	tau = ut.tau(L, R) 
-	gamma = ut.gamma(M, R) 
+	return np.stack( [np.interp(Mc, Mi, mag[:, k], left=np.nan, right=np.nan) for k in range(mag.shape[-1])], axis=-1 )
+
+# interpolate magnitudes from a PARS grid for models with given PARS variables, seen at given inclinations;
+# models with NAN variables are skipped and get NAN magnitudes; 
+# the models are interpolated in chunks of bounded size on a pool of threads,
+# each chunk has all the inclinations of its models;
+# not done: reusing the brackets and weights in tau, omega and gamma across the inclinations of a model;
+# pa.opt.grid.interp4d takes whole points and brackets each of them in all the PARS dimensions, 
+# and the PARS grid nodes and the weights are internal to it; chunks keep the inclinations of a model together,
+# so that such a reuse would only need a version of interp4d that takes the points of a model at once
+# Inputs:
+#	PARS grid
+#	tau, omega and gamma of the models, arrays of the same shape
+#	inclinations
+#	PARS metallicity
+#	reddening
+#	configuration, e.g. the config module
+# Output: magnitudes; dimensions: those of the model variables, inclination, band
+def interp_pars(pars, tau, omega, gamma, inc, logZp, A_V, cf=cf):
+	sh = tau.shape
+	tau, omega, gamma = [ x.flatten() for x in [tau, omega, gamma] ]
 	pars_dims = len(pars.dims) - 3 # number of interpolated PARS dimensions
-	# start with arrays of PARS interpolated variables on a grid of 
-	# MESA independent variables and inclination
-	points = np.full(M.shape + (pars_dims, ), np.nan)
-	points[..., 0] = tau
-	points[..., 1] = 0 # omega is zero
-	points[..., 2] = 0 # inclination can be zero
-	points[..., 3] = gamma 
-	# record the shape of the grid and flatten the grid almost completely,
-	# keeping the arrays of PARS variables intact
-	sh = points.shape[:-1] 
-	points = points.reshape( (-1, pars_dims) )
-	# interpolate from the PARS grid;
-	# the result is an an array of magnitudes, e.g. [F435W, F555W, F814W]
-	mag = gd.interp4d(pars, points, ut.logZp_from_logZm(st.Z), A_V)
-	# reshape magnitudes back to the grid of evolutionary model parameters
-	mag = mag.reshape(sh + (len(pars.bands), ))
-	# correct for radius and distance;
-	# the radius array needs extra dimensions due to bands
-	mag = gd.correct(mag, R[..., np.newaxis], modulus)
-	return mag
\ No newline at end of file
+	nb = len(pars.bands)
+	mag = np.full( (len(tau), len(inc), nb), np.nan )
+	# models with all PARS variables defined
+	i = np.nonzero( ~np.isnan(tau) & ~np.isnan(omega) & ~np.isnan(gamma) )[0]
+	n = max(1, cf.pars_chunk // len(inc)) # number of models in a chunk
+	def interp(j):
+		points = np.empty( (len(j), len(inc), pars_dims) )
+		points[..., 0] = tau[j, np.newaxis]
+		points[..., 1] = omega[j, np.newaxis]
+		points[..., 2] = inc
+		points[..., 3] = gamma[j, np.newaxis]
+		mag[j] = gd.interp4d(pars, points.reshape(-1, pars_dims), logZp, A_V).reshape(len(j), len(inc), nb)
+	chunks = [ i[k : k + n] for k in range(0, len(i), n) ]
+	if len(chunks) > 1:
+		with ThreadPoolExecutor(max_workers=cf.nthreads) as executor:
+			list(executor.map(interp, chunks))
+	elif len(chunks) == 1:
+		interp(chunks[0])
+	return mag.reshape(sh + (len(inc), nb))
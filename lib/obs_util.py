@@ -0,0 +1,257 @@
+# Storage of the observables of models at each age.
+# The observables at an age are in a directory with a small metadata file that holds the age
+# and the model grids (initial mass, binary mass ratio, initial omega, inclination),
+# and the float32 observables in chunks that split the mass ratio and initial omega dimensions;
+# the unary models, at the first mass ratio, are in chunks of their own.
+# Uncompressed chunks are .npy files that are memory-mapped when read, so that reading a slice
+# only touches the chunks and the pages it needs; compressed chunks are lossless .npz files.
+# Alternatively, only the observables of unary models and the magnitudes of the companions are saved,
+# and the observables of binary models are computed from them in blocks of mass ratios when they are read;
+# this takes much less space than the observables of binary models.
+import os, glob, pickle, shutil, warnings, hashlib, json
+import config as cf
+
+import numpy as np
+
+meta_name = 'meta.pkl'
+manifest_name = 'manifest.json'
+# small files of the observables at an age that are re-hashed when a computation is resumed:
+# the metadata and the summary for the diagnostics
+small_names = [meta_name, 'diag.pkl']
+
+# directory of the observables at an age
+def obs_dir(cf, age):
+	return cf.obs_dir + 'obs' + '_t' + ('%.4f' % age).replace('.', 'p') + '/'
+
+# directories of the observables at all ages in a path, in the order of age;
+# directories without metadata, e.g. of interrupted saves, are skipped
+def obs_dirs(path):
+	files = np.sort(glob.glob(os.path.join(path, 'obs_t*', meta_name)))
+	return [ os.path.dirname(file) + '/' for file in files ]
+
+# boundaries of the chunks along a dimension: the first element is in a chunk of its own if required,
+# the others are in chunks of a given size
+def chunk_bounds(n, size, first=False):
+	b = list(range(1 if first else 0, n, max(1, size)))
+	if first: b.insert(0, 0)
+	return np.array(b + [n])
+
+# observables of binary models in blocks of the binary mass ratio dimension, computed in flux space;
+# yields the index of the first mass ratio in a block and the observables in the block
+# Inputs:
+#	companion magnitudes; dimensions: initial primary mass, binary mass ratio, band
+#	primary magnitudes; dimensions: initial primary mass, initial omega, inclination, band
+#	primary vsini; dimensions: initial primary mass, initial omega, inclination
+#	number of mass ratios in a block
+#	whether the models at the first mass ratio are unary
+# Output: observables; dimensions: initial primary mass, binary mass ratio in the block, initial omega, 
+#	inclination, magnitude / color / vsini
+def binary_blocks(mag_c, mag, vsini, nr=8, unary=True):
+	# fluxes of the primaries and the companions
+	fp = 10**(-mag / 2.5)[:, np.newaxis, ...]
+	fc = 10**(-mag_c / 2.5)[:, :, np.newaxis, np.newaxis, :]
+	for k in range(0, mag_c.shape[1], nr):
+		f = fp + fc[:, k:k + nr]
+		ob = np.empty( f.shape[:-1] + (3,) )
+		with warnings.catch_warnings(): # no companions for unary models
+			warnings.simplefilter('ignore')
+			ob[..., 0] = -2.5 * np.log10(f[..., 1]) # F555W magnitude
+			ob[..., 1] = -2.5 * np.log10(f[..., 0] / f[..., 2]) # F435W - F814W color
+		ob[..., 2] = vsini[:, np.newaxis, ...] # vsini
+		if k == 0 and unary: # the unary models
+			ob[:, 0, ..., 0] = mag[..., 1]
+			ob[:, 0, ..., 1] = mag[..., 0] - mag[..., 2]
+		yield k, ob
+
+# write the metadata of the observables at an age last, so that an interrupted save leaves no metadata
+def save_meta(path, meta):
+	with open(os.path.join(path, meta_name), 'wb') as f:
+		pickle.dump(meta, f)
+
+# remove the observables of a previous computation and make an empty directory for the observables at an age
+def make_dir(path):
+	if os.path.isdir(path): shutil.rmtree(path)
+	os.makedirs(path)
+
+# Save the observables at an age
+# Inputs:
+#	directory
+#	observables; dimensions: initial mass, binary mass ratio, initial omega, inclination, observable
+#	age
+#	model grids: initial mass, binary mass ratio, initial omega, inclination
+#	configuration, which sets the chunk sizes and compression
+def save(path, obs, age, Mini, r, omega0, inc, cf=cf):
+	make_dir(path)
+	rb = chunk_bounds(obs.shape[1], cf.obs_chunk[0], first=True)
+	ob = chunk_bounds(obs.shape[2], cf.obs_chunk[1])
+	for i in range(len(rb) - 1):
+		for j in range(len(ob) - 1):
+			chunk = np.ascontiguousarray(obs[:, rb[i]:rb[i + 1], ob[j]:ob[j + 1]], dtype=np.float32)
+			name = os.path.join(path, 'obs_r%d_o%d' % (i, j))
+			if cf.obs_compress: np.savez_compressed(name, obs=chunk)
+			else: np.save(name, chunk)
+	save_meta(path, {'age': age, 'Mini': Mini, 'r': r, 'omega0': omega0, 'inc': inc, 'store': 'binary',
+		'shape': obs.shape, 'r_bounds': rb, 'omega0_bounds': ob, 'compress': cf.obs_compress})
+
+# Save the magnitudes and vsini of unary models and the magnitudes of the companions at an age,
+# from which the observables of binary models are computed when they are read
+# Inputs:
+#	directory
+#	primary magnitudes; dimensions: initial mass, initial omega, inclination, band
+#	primary vsini; dimensions: initial mass, initial omega, inclination
+#	companion magnitudes; dimensions: initial mass, binary mass ratio, band
+#	age
+#	model grids: initial mass, binary mass ratio, initial omega, inclination
+#	configuration, which sets the compression
+def save_unary(path, mag, vsini, mag_c, age, Mini, r, omega0, inc, cf=cf):
+	make_dir(path)
+	arrays = {'mag': mag, 'vsini': vsini, 'mag_c': mag_c}
+	for name, a in arrays.items():
+		if cf.obs_compress: np.savez_compressed(os.path.join(path, name), obs=a)
+		else: np.save(os.path.join(path, name), a)
+	shape = (len(Mini), len(r), len(omega0), len(inc), 3)
+	save_meta(path, {'age': age, 'Mini': Mini, 'r': r, 'omega0': omega0, 'inc': inc, 'store': 'unary',
+		'shape': shape, 'r_bounds': np.array([0, len(r)]), 'omega0_bounds': np.array([0, len(omega0)]),
+		'compress': cf.obs_compress})
+
+# Observables at an age, as saved; the metadata is read on construction, the observables by read()
+class Obs:
+	def __init__(self, path):
+		self.path = path
+		with open(os.path.join(path, meta_name), 'rb') as f:
+			meta = pickle.load(f)
+		self.age = meta['age']
+		self.Mini = meta['Mini']
+		self.r = meta['r']
+		self.omega0 = meta['omega0']
+		self.inc = meta['inc']
+		self.shape = tuple(meta['shape'])
+		self.r_bounds = meta['r_bounds']
+		self.omega0_bounds = meta['omega0_bounds']
+		self.compress = meta['compress']
+		self.store = meta.get('store', 'binary') # 'binary' if the observables of binary models are saved
+
+	# saved array with a given name
+	def load(self, name):
+		name = os.path.join(self.path, name)
+		if self.compress:
+			with np.load(name + '.npz') as f: return f['obs']
+		else: return np.load(name + '.npy', mmap_mode='r')
+
+	# chunk at given indices of the mass ratio and omega chunk boundaries
+	def chunk(self, i, j):
+		return self.load('obs_r%d_o%d' % (i, j))
+
+	# Read a slice of the observables, touching only the chunks that contain it,
+	# or computing the observables of binary models in the slice from the saved unary models
+	# Inputs:
+	#	mass ratio index or slice; an index removes the mass ratio dimension
+	#	initial omega slice, index array or boolean mask
+	# Output: float32 observables;
+	#	dimensions: initial mass, [binary mass ratio,] initial omega, inclination, observable
+	def read(self, r=slice(None), omega0=slice(None)):
+		squeeze = np.isscalar(r)
+		ir = np.atleast_1d(np.arange(self.shape[1])[r])
+		io = np.arange(self.shape[2])[omega0]
+		res = np.empty( (self.shape[0], len(ir), len(io)) + self.shape[3:], dtype=np.float32 )
+		if self.store == 'unary':
+			mag, vsini, mag_c = [ np.asarray(self.load(name)[:, io]) for name in ['mag', 'vsini'] ] + \
+				[ self.load('mag_c') ]
+			unary = len(ir) > 0 and ir[0] == 0 # the first mass ratio index is the lowest
+			for k, ob in binary_blocks(np.asarray(mag_c[:, ir]), mag, vsini, unary=unary):
+				res[:, k:k + ob.shape[1]] = ob
+			if squeeze: res = res[:, 0]
+			return res
+		# chunks of the requested indices
+		cr = np.searchsorted(self.r_bounds, ir, side='right') - 1
+		co = np.searchsorted(self.omega0_bounds, io, side='right') - 1
+		for i in np.unique(cr):
+			mr = cr == i
+			for j in np.unique(co):
+				mo = co == j
+				chunk = self.chunk(i, j)
+				sub = chunk[:, ir[mr] - self.r_bounds[i]][:, :, io[mo] - self.omega0_bounds[j]]
+				res[:, np.nonzero(mr)[0][:, np.newaxis], np.nonzero(mo)[0]] = sub
+		if squeeze: res = res[:, 0]
+		return res
+
+	# Observables in blocks of the binary mass ratio dimension, which cover all the mass ratios;
+	# yields the slice of mass ratios in a block and the float32 observables in the block
+	# Inputs:
+	#	number of mass ratios in a block of computed observables of binary models
+	#	initial omega slice, index array or boolean mask
+	def blocks(self, nr=8, omega0=slice(None)):
+		if self.store == 'unary':
+			io = np.arange(self.shape[2])[omega0]
+			mag, vsini = [ np.asarray(self.load(name)[:, io]) for name in ['mag', 'vsini'] ]
+			for k, ob in binary_blocks(np.asarray(self.load('mag_c')), mag, vsini, nr=nr):
+				yield slice(k, k + ob.shape[1]), ob.astype(np.float32)
+		else: # the saved chunks
+			for i in range(len(self.r_bounds) - 1):
+				rs = slice(self.r_bounds[i], self.r_bounds[i + 1])
+				yield rs, self.read(r=rs, omega0=omega0)
+
+# checksum of the files in a directory of observables, or of the given files in it
+def checksum(path, names=None):
+	h = hashlib.sha256()
+	for name in sorted(os.listdir(path) if names is None else names):
+		h.update(name.encode())
+		with open(os.path.join(path, name), 'rb') as f:
+			for block in iter(lambda: f.read(1 << 20), b''):
+				h.update(block)
+	return h.hexdigest()[:16]
+
+# sizes and modification times in nanoseconds of the files in a directory of observables
+def file_stats(path):
+	stats = {}
+	for name in sorted(os.listdir(path)):
+		st = os.stat(os.path.join(path, name))
+		stats[name] = [st.st_size, st.st_mtime_ns]
+	return stats
+
+# Record of the ages at which the observables have been computed, kept in the observables directory,
+# so that an interrupted computation can be resumed at the remaining ages;
+# for each age, it records the status, the checksum of the outputs, the sizes and modification times of the files,
+# the checksum of the small files, the sizes of the model grids, whether the refinement of the grid stalled,
+# how the observables are stored and the digest of the parameters they depend on, see config.Config.obs_key()
+class Manifest:
+	def __init__(self, cf=cf):
+		self.cf = cf
+		self.file = os.path.join(cf.obs_dir, manifest_name)
+		self.ages = {}
+		if os.path.isfile(self.file):
+			with open(self.file) as f: self.ages = json.load(f)
+
+	@staticmethod
+	def key(age):
+		return '%.4f' % age
+
+	# whether the observables at an age are complete, computed with the parameters of the configuration,
+	# with outputs that match their record:
+	# the files have the recorded sizes and modification times, and the small files match their checksum;
+	# all the files are re-hashed only if verify is True, or if the record has no file sizes
+	def complete(self, age, verify=False):
+		entry = self.ages.get(self.key(age))
+		if entry is None or entry['status'] != 'done' or entry['store'] != self.cf.obs_store: return False
+		if entry.get('params') != self.cf.obs_key(): return False # computed with other parameters
+		path = obs_dir(self.cf, age)
+		if not os.path.isfile(os.path.join(path, meta_name)): return False
+		if verify or 'files' not in entry: return checksum(path) == entry['checksum']
+		return file_stats(path) == entry['files'] and checksum(path, small_names) == entry['small']
+
+	# record that the observables at an age are complete
+	# Inputs:
+	#	age
+	#	summary of the observables, as returned by diag_util.summary()
+	#	whether the refinement of the model grid stalled
+	#	checksum of the outputs, if already computed
+	def record(self, age, summary, stalled=False, digest=None):
+		path = obs_dir(self.cf, age)
+		if digest is None: digest = checksum(path)
+		self.ages[self.key(age)] = {'status': 'done', 'checksum': digest, 'store': self.cf.obs_store, 
+			'files': file_stats(path), 'small': checksum(path, small_names), 'params': self.cf.obs_key(),
+			'stalled': bool(stalled), 'grid': { name: len(summary[name]) for name in ['Mini', 'r', 'omega0', 'inc'] }}
+		# write a temporary file first, so that an interruption leaves the previous manifest
+		tmp = self.file + '.tmp'
+		with open(tmp, 'w') as f: json.dump(self.ages, f, indent=1, sort_keys=True)
+		os.replace(tmp, self.file)
@@ -1,140 +1,199 @@
 # Load NGC1846 data, filter it
-import sys, os
+# The catalog is built by an explicit call to Catalog.load(); the merged, filtered catalog is cached
+# as binary arrays keyed by the contents of the input files and the filtering parameters, so that later
+# loads memory-map the cached arrays instead of re-parsing the text files.
+# For backward compatibility, module attributes such as load_data.obs or load_data.nobs
+# refer to a default catalog, which is loaded on first access to any of them.
+import sys, os, hashlib, shutil, itertools
 sys.path.append(os.path.abspath(os.path.join('..', 'paint_atmospheres')))
 import config as cf
 
 import numpy as np
-from matplotlib import pyplot as plt
-from scipy import special
-from scipy import optimize
 
 dirname = os.path.dirname(__file__)
 datadir = os.path.join(dirname, 'data/')
+cachedir = os.path.join(datadir, 'cache/')
 
-# load data on stars with vsini
-file = datadir + 'ngc1846_vsini.txt'
-data0 = np.loadtxt(file).T
-data0 = data0[0:12] # select fields
-# record the range of these stars in RA and dec; this should be close to the MUSE field of view (FOV)
-ramin = data0[-2].min()
-ramax = data0[-2].max()
-demin = data0[-1].min()
-demax = data0[-1].max()
-# delete the entries without valid IDs, observables or sky coordinates, 
-# as well as those outside the color-magnitude window
-mag = data0[2]
-col = data0[1] - data0[3] 
-m = np.all(data0 != 99, axis=0) & \
-	(mag <= cf.ROI[0][1]) & (mag >= cf.ROI[0][0]) & (col <= cf.ROI[1][1]) & (col >= cf.ROI[1][0])
-data0 = data0[:, m]
-# record the observable fields
-ID = data0[0].astype(int)
-f435w = data0[1]
-f555w = data0[2]
-f814w = data0[3]
-f435w_err = data0[4]
-f555w_err = data0[5]
-f814w_err = data0[6]
-vsini = data0[7]
-vsini_uperr = data0[8]
-vsini_loerr = data0[9]
-vsini_err = (vsini_loerr + vsini_uperr) / 2
-
-# load data on low-vsini stars
-file = datadir + 'ngc1846_lowvsini.txt'
-data1 = np.loadtxt(file).T
-data1 = data1[0:12] # select fields
-# delete the entries without valid IDs, observables or sky coordinates, 
-# those outside the color-magnitude window or outside the MUSE FOV,
-# as well as those that had data with normal vsini 
-mag = data1[2]
-col = data1[1] - data1[3] 
-ra = data1[-2]
-dec = data1[-1]
-ID1 = data1[0].astype(int)
-m = np.all(data1 != 99, axis=0) & \
-	(mag <= cf.ROI[0][1]) & (mag >= cf.ROI[0][0]) & (col <= cf.ROI[1][1]) & (col >= cf.ROI[1][0]) & \
-	(ra <= ramax) & (ra >= ramin) & (dec <= demax) & (dec >= demin) & \
-	~np.isin(ID1, ID)
-data1 = data1[:, m]
-# merge with previous data
-ID_vsini = np.concatenate( (ID, ID1) )
-f435w = np.concatenate( (f435w, data1[1]) )
-f555w = np.concatenate( (f555w, data1[2]) )
-f814w = np.concatenate( (f814w, data1[3]) )
-f435w_err = np.concatenate( (f435w_err, data1[4]) )
-f555w_err = np.concatenate( (f555w_err, data1[5]) )
-f814w_err = np.concatenate( (f814w_err, data1[6]) )
-# -1 in vsini and its error means vsini measurement was either below zero or couldn't be distinguished from zero
-vsini = np.concatenate( (vsini, np.full_like(data1[7], -1, dtype=float)) ) 
-vsini_err = np.concatenate( (vsini_err, np.full_like(data1[8], -1, dtype=float)) )
-
-# load data on stars without vsini in the MUSE FOV
-file = datadir + 'ngc1846_full.txt'
-data2 = np.loadtxt(file).T
-data2 = data2[0:9] # select fields
-# delete the entries without valid IDs, observables or sky coordinates, 
-# those outside the color-magnitude window or outside the MUSE FOV,
-# as well as those that had data with vsini or low vsini
-mag = data2[2]
-col = data2[1] - data2[3]
-ra = data2[-2]
-dec = data2[-1]
-ID2 = data2[0].astype(int)
-m = np.all(data2 != 99, axis=0) & \
-	(mag <= cf.ROI[0][1]) & (mag >= cf.ROI[0][0]) & (col <= cf.ROI[1][1]) & (col >= cf.ROI[1][0]) & \
-	(ra <= ramax) & (ra >= ramin) & (dec <= demax) & (dec >= demin) & \
-	~np.isin(ID2, ID_vsini)
-data2 = data2[:, m]
-
-# merge all the data; set vsini-related fields appropriately
-vsini_nan = np.full(data2.shape[1], np.nan)
-ID = np.concatenate( (ID, ID2) )
-f435w = np.concatenate( (f435w, data2[1]) )
-f555w = np.concatenate( (f555w, data2[2]) )
-f814w = np.concatenate( (f814w, data2[3]) )
-f435w_err = np.concatenate( (f435w_err, data2[4]) )
-f555w_err = np.concatenate( (f555w_err, data2[5]) )
-f814w_err = np.concatenate( (f814w_err, data2[6]) )
-vsini = np.concatenate( (vsini, np.copy(vsini_nan)) )
-vsini_err = np.concatenate( (vsini_err, np.copy(vsini_nan)) )
-# get color
-color = f435w - f814w
-color_err = np.sqrt(f435w_err**2 + f814w_err**2)
-
-## compute the boundaries of the color, magnitude and vsini space where we will need model priors
-obs = np.stack( (f555w, color, vsini), axis=1 )
-std = np.stack( (f555w_err, color_err, vsini_err), axis=1 )
-std = np.maximum(std, cf.std[np.newaxis,:]) # apply the minimum bound on error
-stdr = cf.std[np.newaxis,:] / std # ratio of minimum error to actual error
-ker = cf.nsig * std * ( stdr + np.sqrt(1 - stdr**2) ) # half an error kernel
-## data space grids with ranges that will allow 
-## probability leakage checks and error kernel integration for individual stars;
-## with coarse steps at least as small as the minimum standard deviations
-obs0 = np.minimum.reduce([ 	cf.ROI[:, 0], np.nanmin(obs - ker, axis=0), \
-							cf.ROI[:, 0] - cf.denorm_err * cf.nsig * cf.std ])
-obs1 = np.maximum.reduce([ 	cf.ROI[:, 1], np.nanmax(obs + ker, axis=0), \
-							cf.ROI[:, 1] + cf.denorm_err * cf.nsig * cf.std ]) 
-nobs = cf.downsample * ( np.ceil((obs1 - obs0) / cf.std + 1).astype(int) ) # number of entries
-obs_grids = [] # observable grids
-step = np.empty( len(nobs) ) # their steps
-for i in range(len(nobs)):
-	ogrid = np.linspace(obs0[i], obs1[i], nobs[i]) # grid for this observable
-	obs_grids.append(ogrid)
-	step[i] = ogrid[1] - ogrid[0]
-# resvar = (err/cf.std)**2 - 1 # residual relative variance
-# resvar[np.less(resvar, 0, where=~np.isnan(resvar))] = 0 # correct for round-off error
-# margin = cf.nsig * cf.std * (1 + np.sqrt(resvar))
-# # minimum boundaries needed for individual stars
-# obmax = np.nanmax(obs + margin, axis=0)
-# obmin = np.nanmin(obs - margin, axis=0)
-# minimum boundaries needed for the initial convolution and probability leakage checks
-# obmax_conv = 
-# obmin_conv = 
-# # boundaries that determine which models are computed;
-# # these are the minimum needed for individual stars, initial convolution and probability checks
-# obmax = np.maximum(obmax, obmax_conv)
-# obmin = np.minimum(obmin, obmin_conv)
-# plotting boundaries - these are inside the area where minimum-error density is defined
-obmax_plot = cf.ROI[:, 1] + cf.plot_err * cf.nsig * cf.std
-obmin_plot = cf.ROI[:, 0] - cf.plot_err * cf.nsig * cf.std
+# input catalogs, in the order of precedence: stars with vsini, low-vsini stars, stars without vsini
+files = ['ngc1846_vsini.txt', 'ngc1846_lowvsini.txt', 'ngc1846_full.txt']
+# fields of the merged catalog that are cached
+fields = ['ID', 'f435w', 'f555w', 'f814w', 'f435w_err', 'f555w_err', 'f814w_err', 'vsini', 'vsini_err']
+
+# number of catalog rows parsed at a time
+chunksize = 100000
+# data type of the merged catalog
+dtype = np.dtype([ (field, int if field == 'ID' else float) for field in fields ])
+
+# read a text catalog in chunks of rows;
+# yields arrays of the first ncols fields, with fields along the first axis
+def read_chunks(file, ncols, chunksize=chunksize):
+	with open(file) as f:
+		while True:
+			lines = list(itertools.islice(f, chunksize))
+			if len(lines) == 0: break
+			yield np.loadtxt(lines, ndmin=2)[:, :ncols].T
+
+class Catalog:
+	# attributes that become available after loading
+	attrs = fields + ['color', 'color_err', 'obs', 'std', 'stdr', 'ker', 'obs0', 'obs1', 'nobs', \
+		'obs_grids', 'step', 'obmax_plot', 'obmin_plot']
+
+	# Inputs:
+	# 	cluster parameters, e.g. the config module
+	#	directory of the input catalogs
+	#	directory of the cached catalogs; None to disable caching
+	def __init__(self, cf=cf, datadir=datadir, cachedir=cachedir):
+		self.cf = cf
+		self.datadir = datadir
+		self.cachedir = cachedir
+
+	# hash of the input files and the parameters that determine the filtering of the data
+	def key(self):
+		h = hashlib.sha256()
+		for file in files:
+			with open(os.path.join(self.datadir, file), 'rb') as f:
+				for block in iter(lambda: f.read(1 << 20), b''):
+					h.update(block)
+		h.update(np.ascontiguousarray(self.cf.ROI, dtype=float).tobytes())
+		h.update(np.ascontiguousarray(self.cf.std, dtype=float).tobytes())
+		return h.hexdigest()[:16]
+
+	# load the merged and filtered catalog, from the cache if possible;
+	# then compute the data space grids
+	def load(self):
+		path = None
+		if self.cachedir is not None:
+			path = os.path.join(self.cachedir, 'catalog_' + self.key())
+		if path is not None and os.path.isdir(path):
+			for field in fields:
+				setattr(self, field, np.load(os.path.join(path, field + '.npy'), mmap_mode='r'))
+		else:
+			self.parse()
+			if path is not None: self.save(path)
+		self.set_vars()
+		return self
+
+	# save the merged catalog; write to a temporary directory first,
+	# so that an interrupted save doesn't leave a partial cache
+	def save(self, path):
+		tmp = path + '.tmp' + str(os.getpid())
+		os.makedirs(tmp, exist_ok=True)
+		for field in fields:
+			np.save(os.path.join(tmp, field + '.npy'), getattr(self, field))
+		try:
+			os.rename(tmp, path)
+		except OSError: # another process has saved the same catalog in the meantime
+			shutil.rmtree(tmp, ignore_errors=True)
+
+	# parse the text catalogs in chunks of rows, filter each chunk as it is read and
+	# merge the remaining rows into one structured array, in the order of precedence of the catalogs
+	def parse(self):
+		cf = self.cf
+		cat = np.empty(chunksize, dtype=dtype) # merged catalog, with spare capacity
+		n = 0 # number of rows in the merged catalog
+		seen = set() # IDs of stars that take precedence over stars in the subsequent catalogs
+		# range of the stars with vsini in RA and dec; this should be close to the MUSE field of view (FOV)
+		ramin = demin = np.inf
+		ramax = demax = -np.inf
+		for k, file in enumerate(files):
+			ncols = 9 if k == 2 else 12 # number of fields to select
+			IDs = [] # IDs of all stars in this catalog
+			for data in read_chunks(os.path.join(self.datadir, file), ncols):
+				ra = data[-2]
+				dec = data[-1]
+				if k == 0: # stars with vsini determine the FOV
+					ramin = min(ramin, ra.min()); ramax = max(ramax, ra.max())
+					demin = min(demin, dec.min()); demax = max(demax, dec.max())
+				ID = data[0].astype(int)
+				if k == 1: IDs.append(ID)
+				# delete the entries without valid IDs, observables or sky coordinates,
+				# those outside the color-magnitude window or outside the MUSE FOV
+				mag = data[2]
+				col = data[1] - data[3]
+				m = np.all(data != 99, axis=0) & \
+					(mag <= cf.ROI[0][1]) & (mag >= cf.ROI[0][0]) & (col <= cf.ROI[1][1]) & (col >= cf.ROI[1][0])
+				if k > 0:
+					m &= (ra <= ramax) & (ra >= ramin) & (dec <= demax) & (dec >= demin)
+					# as well as those that had data in a catalog that takes precedence;
+					# look up only the IDs of the entries that pass the other cuts
+					i = np.nonzero(m)[0]
+					m[i] = np.fromiter((j not in seen for j in ID[i].tolist()), dtype=bool, count=len(i))
+				data = data[:, m]
+				rows = np.empty(data.shape[1], dtype=dtype)
+				rows['ID'] = data[0].astype(int)
+				rows['f435w'] = data[1]
+				rows['f555w'] = data[2]
+				rows['f814w'] = data[3]
+				rows['f435w_err'] = data[4]
+				rows['f555w_err'] = data[5]
+				rows['f814w_err'] = data[6]
+				if k == 0: # vsini and the average of its upper and lower errors
+					rows['vsini'] = data[7]
+					rows['vsini_err'] = (data[8] + data[9]) / 2
+				elif k == 1:
+					# -1 in vsini and its error means vsini measurement was either below zero
+					# or couldn't be distinguished from zero
+					rows['vsini'] = -1
+					rows['vsini_err'] = -1
+				else:
+					rows['vsini'] = np.nan
+					rows['vsini_err'] = np.nan
+				# append the rows to the merged catalog, doubling its capacity if necessary
+				if n + len(rows) > len(cat):
+					cat = np.resize(cat, max(2 * len(cat), n + len(rows)))
+				cat[n : n + len(rows)] = rows
+				if k == 0: seen.update(rows['ID'].tolist())
+				n += len(rows)
+			# all low-vsini stars take precedence over the stars without vsini
+			if k == 1: 
+				for ID in IDs: seen.update(ID.tolist())
+		cat = cat[:n]
+		for field in fields:
+			setattr(self, field, cat[field])
+
+	# compute the observables and the data space grids from the merged catalog
+	def set_vars(self):
+		cf = self.cf
+		# get color
+		self.color = self.f435w - self.f814w
+		self.color_err = np.sqrt(self.f435w_err**2 + self.f814w_err**2)
+
+		## compute the boundaries of the color, magnitude and vsini space where we will need model priors
+		self.obs = np.stack( (self.f555w, self.color, self.vsini), axis=1 )
+		std = np.stack( (self.f555w_err, self.color_err, self.vsini_err), axis=1 )
+		self.std = np.maximum(std, cf.std[np.newaxis,:]) # apply the minimum bound on error
+		self.stdr = cf.std[np.newaxis,:] / self.std # ratio of minimum error to actual error
+		self.ker = cf.nsig * self.std * ( self.stdr + np.sqrt(1 - self.stdr**2) ) # half an error kernel
+		## data space grids with ranges that will allow
+		## probability leakage checks and error kernel integration for individual stars;
+		## with coarse steps at least as small as the minimum standard deviations
+		self.obs0 = np.minimum.reduce([ cf.ROI[:, 0], np.nanmin(self.obs - self.ker, axis=0), \
+										cf.ROI[:, 0] - cf.denorm_err * cf.nsig * cf.std ])
+		self.obs1 = np.maximum.reduce([ cf.ROI[:, 1], np.nanmax(self.obs + self.ker, axis=0), \
+										cf.ROI[:, 1] + cf.denorm_err * cf.nsig * cf.std ])
+		self.nobs = cf.downsample * ( np.ceil((self.obs1 - self.obs0) / cf.std + 1).astype(int) ) # number of entries
+		self.obs_grids = [] # observable grids
+		self.step = np.empty( len(self.nobs) ) # their steps
+		for i in range(len(self.nobs)):
+			ogrid = np.linspace(self.obs0[i], self.obs1[i], self.nobs[i]) # grid for this observable
+			self.obs_grids.append(ogrid)
+			self.step[i] = ogrid[1] - ogrid[0]
+		# plotting boundaries - these are inside the area where minimum-error density is defined
+		self.obmax_plot = cf.ROI[:, 1] + cf.plot_err * cf.nsig * cf.std
+		self.obmin_plot = cf.ROI[:, 0] - cf.plot_err * cf.nsig * cf.std
+
+# the default catalog
+_catalog = None
+
+# load the default catalog if it hasn't been loaded yet, return it
+def catalog():
+	global _catalog
+	if _catalog is None:
+		_catalog = Catalog().load()
+	return _catalog
+
+# module attributes of the default catalog, e.g. load_data.obs, are loaded on first access
+def __getattr__(name):
+	if name in Catalog.attrs:
+		return getattr(catalog(), name)
+	raise AttributeError("module '" + __name__ + "' has no attribute '" + name + "'")
@@ -118,7 +118,7 @@ with open('data/pars_grid_ZM' + str(cf.Z).replace('-', 'm').replace('.', 'p') +
 print('%.2f' % (time.time() - start) + ' seconds.', flush=True)
 mu.Grid.pars = pars # give a PARS grid reference to the grid class
 # apply the lower mass cut-off for the primaries according the region of interest on the CMD 
-Mmin = mu.Mlim(st)
+Mmin, _ = mu.Mlim(st)
 st.select_mass(Mmin=Mmin)
 print('minimum mass = ' + '%.4f' % Mmin, flush=True)
 
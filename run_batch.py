@@ -0,0 +1,48 @@
+# Run the pipeline for a list of configurations in one process.
+# Configurations are grouped by the expensive inputs they share: configurations with the same
+# metallicity use the same MIST models, which are then loaded once per group, and configurations
+# with the same PARS grid file share the loaded grid.
+# Configurations whose observables differ (e.g. in metallicity, reddening or distance modulus, see
+# config.Config.obs_params) should have their own observables directories; configurations with the same
+# observables directory and the same parameters of the observables share the observables, 
+# which are then computed once; if the parameters differ, the observables in the directory are recomputed 
+# for each configuration, after the previous configuration has used them.
+import os
+import calc_obs, calc_dens, calc_dens_mix, calc_like
+from config import Config
+
+# Inputs:
+#	list of configurations
+#	stages of the pipeline to run: 'obs' for the observables, 'dens' for the point densities,
+#		'like' for the likelihoods
+def run(configs, stages=('obs', 'dens', 'like')):
+	# group the configurations by metallicity
+	groups = {}
+	for cf in configs:
+		groups.setdefault(cf.Z, []).append(cf)
+	pars = {} # PARS grids by file name
+	for Z, group in groups.items():
+		print('\n[M/H]_M = ' + str(Z) + ': ' + str(len(group)) + ' configuration(s)', flush=True)
+		if 'obs' in stages: st = calc_obs.load_mist(Z) # load the models shared by the group
+		obs = {} # digests of the parameters of the observables that are in each observables directory
+		for cf in group:
+			for d in [cf.obs_dir] + cf.out_dirs():
+				os.makedirs(d, exist_ok=True)
+			if 'obs' in stages and obs.get(cf.obs_dir) != cf.obs_key():
+				if cf.obs_dir in obs: 
+					print('recomputing the observables in ' + cf.obs_dir + ' with other parameters', flush=True)
+				if cf.pars_file() not in pars: pars[cf.pars_file()] = calc_obs.load_pars(cf)
+				calc_obs.main(cf, st=st, pars=pars[cf.pars_file()])
+				obs[cf.obs_dir] = cf.obs_key()
+			if 'dens' in stages:
+				if cf.mix: calc_dens_mix.main(cf)
+				else: calc_dens.main(cf)
+			if 'like' in stages: calc_like.main(cf)
+
+if __name__ == '__main__':
+	# the default configuration and a variant with a wider fast rotational population,
+	# which shares the observables of the default configuration
+	configs = [ Config(),
+				Config(s_fast=0.1, dens_dir='data/sf0p10/densities/pkl/', points_dir='data/sf0p10/points/',
+					like_dir='data/sf0p10/likelihoods/') ]
+	run(configs)
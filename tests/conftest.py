@@ -0,0 +1,35 @@
+# the tests import the pipeline modules from the root of the repository
+import os, sys, types, importlib.util
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import numpy as np
+
+# The pipeline imports the PARS modules of paint_atmospheres (the pa package), which is not installed
+# with the other requirements; without it, the tests use stand-ins with the same interface
+# and smooth, monotonic functions in place of the rotating-star models and the PARS grid.
+# None of the tests depends on the values of these functions, only on their being deterministic.
+def stub_pa():
+	surface = types.ModuleType('pa.lib.surface')
+	surface.omin, surface.omax = 0., 0.99
+	surface.omega = lambda oMc: np.asarray(oMc) * 1.1 # PARS' omega from Omega / Omega_c
+	surface.V = lambda omega: 4 * np.pi / 3 * (1 + 0.1 * np.asarray(omega)**2) # volume of a unit star
+	util = types.ModuleType('pa.lib.util')
+	util.tau = lambda L, R: np.log10(L) - 2 * np.log10(R)
+	util.gamma = lambda M, R: np.log10(M) - 2 * np.log10(R)
+	util.logZp_from_logZm = lambda Z: Z
+	util.vsini1 = lambda M, R, omega, inc: 1e7 * omega * np.sqrt(M / R) * np.sin(inc)
+	grid = types.ModuleType('pa.opt.grid')
+	# magnitudes in three bands at points with columns tau, omega, inclination, gamma
+	def interp4d(pars, points, logZp, A_V):
+		tau, om, inc, gam = points.T
+		return np.stack([ -2.5 * tau + 0.3 * om * np.cos(inc) + 0.1 * gam + (1 - k) * 0.35 + A_V \
+			for k in range(3) ], axis=-1)
+	grid.interp4d = interp4d
+	grid.correct = lambda mag, R, modulus: mag - 5 * np.log10(R) + modulus
+	modules = {'pa': types.ModuleType('pa'), 'pa.lib': types.ModuleType('pa.lib'), 'pa.opt': types.ModuleType('pa.opt'),
+		'pa.lib.surface': surface, 'pa.lib.util': util, 'pa.opt.grid': grid}
+	modules['pa'].lib, modules['pa'].opt = modules['pa.lib'], modules['pa.opt']
+	modules['pa.lib'].surface, modules['pa.lib'].util = surface, util
+	modules['pa.opt'].grid = grid
+	sys.modules.update(modules)
+
+if importlib.util.find_spec('pa') is None: stub_pa()
@@ -0,0 +1,64 @@
+# The direct CMD density of calc_dens, from the models deposited on the magnitude-color grid,
+# against the density on the grid of observables marginalized over vsini
+import types
+import numpy as np
+import pytest
+import config
+import calc_dens
+from lib import dens_util as du
+
+# a configuration with coarse minimum errors, which keeps the grids of observables small
+cf = config.Config(std=np.array([0.05, 0.07, 30.]), denorm_err=2, nthreads=1)
+
+# grids of observables, as load_data.Catalog computes them when all the data points are inside the ROI
+def catalog(cf=cf):
+	ext = cf.denorm_err * cf.nsig * cf.std
+	obs0, obs1 = cf.ROI[:, 0] - ext, cf.ROI[:, 1] + ext
+	nobs = cf.downsample * ( np.ceil((obs1 - obs0) / cf.std + 1).astype(int) )
+	return types.SimpleNamespace(obs_grids=[ np.linspace(a, b, n) for a, b, n in zip(obs0, obs1, nobs) ])
+
+# observables of synthetic models in blocks of r; dimensions of each block:
+# initial mass, r, initial omega, inclination, observable; all the models are on the grid of observables
+# in vsini, far enough from its edges for the convolution kernels,
+# and some are off it in magnitude and color
+def blocks(ld, shape=(40, 12, 6, 5), nr=5, seed=1):
+	rng = np.random.default_rng(seed)
+	lo = np.array([ g[0] for g in ld.obs_grids ]) + [-0.2, -0.1, 300.]
+	hi = np.array([ g[-1] for g in ld.obs_grids ]) + [0.2, 0.1, -300.]
+	obs = lo + (hi - lo) * rng.random(shape + (3,))
+	return [ (slice(i, min(i + nr, shape[1])), obs[:, i:i + nr]) for i in range(0, shape[1], nr) ]
+
+@pytest.mark.parametrize('deposit', ['nearest', 'linear'])
+def test_cmd(deposit):
+	ld = catalog()
+	bl = blocks(ld)
+	Mini = np.linspace(1., 2., 40)
+	r = np.linspace(0, 1, 12)
+	omega0 = np.linspace(0, 1, 6)
+	inc = np.linspace(0, np.pi/2, 5)
+	prior = calc_dens.model_prior(Mini, r, omega0, inc)
+	pr_om = calc_dens.omega_prior(omega0, cf.om_sets[:1])
+	dep = du.deposits(iter(bl), [ld.obs_grids, ld.obs_grids[:2]], prior, pr_om, linear=deposit == 'linear')
+	# one pass over the blocks places the models as separate passes do,
+	# and the sums over the blocks are those over all the models at once
+	for d, grids in zip(dep, [ld.obs_grids, ld.obs_grids[:2]]):
+		ref = du.Deposit(iter(bl), grids, prior, pr_om, linear=deposit == 'linear')
+		assert np.array_equal(d.bins, ref.bins) and np.array_equal(d.sums, ref.sums)
+		rs = slice(0, len(r))
+		whole = du.Deposit([(rs, np.concatenate([ ob for _, ob in bl ], axis=1))], grids, prior, pr_om, \
+			linear=deposit == 'linear')
+		assert np.array_equal(d.bins, whole.bins) and np.allclose(d.sums, whole.sums, rtol=1e-12, atol=0)
+		# without the binary models, the unary priors are the same
+		unary = du.Deposit(iter(bl), grids, prior, pr_om, binary=False, linear=deposit == 'linear')
+		assert unary.channels()[1] is None
+		assert np.array_equal(unary.grid(unary.channels()[0][0], np.float64), d.grid(d.channels()[0][0], np.float64))
+	p3, p2 = [ d.channels() for d in dep ]
+	for k in range(2): # unary and binary
+		for c in range(len(pr_om)):
+			density, density_cmd, _ = calc_dens.population_densities(dep[0].grid(p3[k][c]), dep[1].grid(p2[k][c]), \
+				1e9, ld, cf=cf)
+			# the densities are float32, and the marginal sums over vsini differ from the CMD convolutions by round-off
+			density.marginalize(2)
+			assert np.array_equal(density.obs[0], density_cmd.obs[0])
+			assert np.array_equal(density.obs[1], density_cmd.obs[1])
+			assert np.abs(density.dens - density_cmd.dens).max() <= 1e-4 * density_cmd.dens.max()
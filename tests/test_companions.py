@@ -0,0 +1,42 @@
+# Companion magnitudes from the cached tables of non-rotating models do not depend on the order of the calls,
+# e.g. on a set cut to the masses of the primaries being tabulated first at the same age
+import types
+import numpy as np
+import config
+from lib import mist_util as mu
+
+# non-rotating models at one age with a smooth mass-luminosity-radius relation;
+# columns as in mist_util.Set.cols
+def models(Mini, age=9.1, Z=-0.45):
+	n = len(Mini)
+	m = np.zeros( (n, len(mu.Set.cols)) )
+	m[:, 0] = Z
+	m[:, 2] = np.arange(n) + 200 # EEP
+	m[:, 3] = age
+	m[:, 4] = Mini
+	m[:, 5] = Mini * 0.99 # mass
+	m[:, 6] = 4 * np.log10(Mini) # log luminosity
+	m[:, 8] = 0.8 * np.log10(Mini) # log radius
+	st = mu.Set(age=age, Z=Z)
+	st.set_models(m)
+	st.age, st.Z = age, Z
+	return st
+
+def test_order():
+	cf = config.Config(companion_nm=200, nthreads=1)
+	pars = types.SimpleNamespace(dims=[None] * 7, bands=['F435W', 'F555W', 'F814W'])
+	full = models(np.linspace(0.5, 3., 60))
+	cut = full.copy(); cut.select(cut.Mini >= 1.5) # e.g. the primaries between the mass cut-offs
+	r = np.linspace(0, 1, 11)
+	Mini = np.linspace(1.5, 3., 7)
+	res = []
+	for order in [[full, cut], [cut, full]]:
+		mu.companion_tables.clear()
+		res.append([ mu.companion_grid(r, Mini, st, pars, 0.26, 18.45, cf=cf) for st in order ])
+	mu.companion_tables.clear()
+	assert np.array_equal(res[0][0], res[1][1], equal_nan=True)
+	assert np.array_equal(res[0][1], res[1][0], equal_nan=True)
+	# companions less massive than the cut set are only tabulated from the full set
+	Mc = Mini[:, np.newaxis] * r[np.newaxis, :]
+	assert np.array_equal(np.isnan(res[0][0][..., 0]), Mc < full.Mini.min())
+	assert np.array_equal(np.isnan(res[0][1][..., 0]), Mc < cut.Mini.min())
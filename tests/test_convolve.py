@@ -0,0 +1,64 @@
+# Equivalence of the convolution backends in dens_util.convolve with the direct (ndimage) convolution,
+# on grids whose region of interest is as close to an edge as the kernels allow
+import numpy as np
+import pytest
+import config
+from lib import dens_util as du
+
+# maximum differences relative to the maximum of the direct convolution:
+# FFT and strided convolutions are exact up to float32 round-off; 
+# the recursive (IIR) Gaussian is an approximation with errors of a few percent of the peak
+tol = {'fft': 1e-6, 'strided': 1e-6, 'iir': 5e-2}
+
+# a density on a grid with unit steps, whose ROI starts as close to the lower edge as a kernel allows
+# in each dimension, and ends close to the upper edge
+def grid(shape, n, dtype, seed=0):
+	rng = np.random.default_rng(seed)
+	dens = (rng.random(shape)**8).astype(dtype)
+	obs = [ np.arange(m, dtype=float) for m in shape ]
+	ROI = np.array([ [n, m - n - 2] for m in shape ], dtype=float)
+	return du.Grid(dens, obs, ROI, [True] * len(shape))
+
+@pytest.mark.parametrize('method', ['fft', 'strided', 'iir'])
+@pytest.mark.parametrize('ds', [1, config.downsample])
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+@pytest.mark.parametrize('shape', [(61, 47, 53), (80, 70)])
+def test_backends(method, ds, dtype, shape):
+	if method in ['strided', 'iir']: pytest.importorskip('numba')
+	cf = config.Config(nthreads=2)
+	kernel = du.kernel(3., config.nsig - 1, ds=ds)
+	for axis in range(len(shape)):
+		g = grid(shape, kernel.n, dtype)
+		assert g.check_roi(axis, kernel)
+		ref = g.copy(); ref.convolve(axis, kernel, ds=ds, method='direct', cf=cf)
+		res = g.copy(); res.convolve(axis, kernel, ds=ds, method=method, cf=cf)
+		assert res.dens.shape == ref.dens.shape and res.dens.dtype == ref.dens.dtype
+		assert np.array_equal(res.obs[axis], ref.obs[axis])
+		assert np.array_equal(res.step, ref.step)
+		assert np.abs(res.dens - ref.dens).max() <= tol[method] * np.abs(ref.dens).max()
+
+# the automatic choice is one of the exact backends
+def test_auto():
+	cf = config.Config(nthreads=1)
+	kernel = du.kernel(3., config.nsig - 1, ds=config.downsample)
+	g = grid((61, 47, 53), kernel.n, np.float32)
+	for axis in range(3):
+		assert du.conv_method(g.dens.shape, axis, kernel, config.downsample, cf=cf) in ['direct', 'fft', 'strided']
+		ref = g.copy(); ref.convolve(axis, kernel, ds=config.downsample, method='direct', cf=cf)
+		res = g.copy(); res.convolve(axis, kernel, ds=config.downsample, cf=cf)
+		assert np.abs(res.dens - ref.dens).max() <= 1e-6 * np.abs(ref.dens).max()
+
+# without numba, the automatic choice is an exact numpy backend, and the numba backends raise
+def test_no_numba(monkeypatch):
+	monkeypatch.setattr(du, 'nb', None)
+	cf = config.Config(nthreads=1)
+	kernel = du.kernel(3., config.nsig - 1, ds=config.downsample)
+	g = grid((61, 47, 53), kernel.n, np.float32)
+	for axis in range(3):
+		assert du.conv_method(g.dens.shape, axis, kernel, config.downsample, cf=cf) in ['direct', 'fft']
+		ref = g.copy(); ref.convolve(axis, kernel, ds=config.downsample, method='direct', cf=cf)
+		res = g.copy(); res.convolve(axis, kernel, ds=config.downsample, cf=cf)
+		assert np.abs(res.dens - ref.dens).max() <= 1e-6 * np.abs(ref.dens).max()
+	for method in ['strided', 'iir']:
+		with pytest.raises(du.ConvolutionException):
+			g.copy().convolve(0, kernel, ds=config.downsample, method=method, cf=cf)